@@ -0,0 +1,255 @@
+import heapq
+import os
+import random
+from itertools import islice
+from math import sqrt
+from operator import itemgetter
+import numpy as np
+from AdapterTrimmer import compute_border_table
+from SuffixTree import SuffixTree
+
+HASH_BASE_VALUE = 0x100000001B3  # odd base of the polynomial suffix hashes (the 64 bit FNV prime)
+HASH_BASE = np.uint64(HASH_BASE_VALUE)
+HASH_MASK = (1 << 64) - 1
+
+
+def sample_lines(path, sample_size, rng=random, end=None):
+    """
+    Samples lines of a file with replacement by seeking to random byte offsets and taking the line after the one
+    hit, so it takes the same time no matter the file size. Lines after longer lines are more likely, which doesn't
+    matter for equally long reads.
+    Args:
+        path: path of the file with one read per line
+        sample_size: number of lines to sample
+        rng: random.Random instance (or the random module) to draw the offsets from
+        end: only sample the lines before this byte offset (a line start), the whole file by default
+    Returns: list of the sampled lines, stripped
+    """
+    end = os.path.getsize(path) if end is None else end
+    sample = []
+    with open(path, "rb") as file:
+        while len(sample) < sample_size and end > 0:
+            file.seek(rng.randrange(end))
+            file.readline()  # rest of the line hit
+            line = file.readline() if file.tell() < end else b""
+            if len(line) == 0:
+                # past the last line, wrap around to the first one
+                file.seek(0)
+                line = file.readline()
+            line = line.strip()
+            if len(line) > 0:
+                sample.append(line.decode("ascii"))
+    return sample
+
+
+def count_lines(path, number_of_lines=None, head_size=1000):
+    """
+    Counts the lines of a file without reading all of it: the first head_size lines are read and the rest is
+    estimated from their average length in bytes. With number_of_lines, only the first number_of_lines lines count and
+    are read to find where they end.
+    Returns: (exact or estimated number of lines, byte offset of the end of the counted lines)
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        line_count = 0
+        for _ in islice(file, number_of_lines if number_of_lines is not None else head_size):
+            line_count += 1
+        end = file.tell()
+    if number_of_lines is not None or end == file_size or line_count == 0:
+        return line_count, end
+    return round(file_size * line_count / end), file_size
+
+
+def discover_adapter(path, initial_sample_size=10000, growth_factor=2, max_sample_size=1000000, stable_rounds=2,
+                     confidence_z=3.0, seed=None, number_of_lines=None, verbose=False):
+    """
+    Guesses the adapter as the most common suffix (see SuffixTree.find_most_common_suffixes) of growing random samples
+    of the reads instead of all of them. Stops as soon as the top-ranked suffix was the same in stable_rounds
+    consecutive samples, so the time needed depends on the sample sizes only and not on the dataset size. Suffixes
+    containing one another count as the same, the longer one is kept, but for suffixes starting the same the fractions
+    of the sampled reads ending in one of their prefixes also have to agree within the confidence margin. Once a
+    sample would have as many reads as the file (see count_lines), the tree of all reads is used instead.
+    Args:
+        path: path of the file with one read per line
+        initial_sample_size: number of reads in the first sample
+        growth_factor: factor the sample size grows by from one sample to the next
+        max_sample_size: the top-ranked suffix of the sample of at least this size is returned even if not stable
+        stable_rounds: number of consecutive samples that have to agree
+        confidence_z: width of the confidence margin in standard errors of the fractions
+        seed: seed of the random sampling
+        number_of_lines: only use the first number_of_lines reads, all of them by default
+        verbose: print the top-ranked suffix of each sample
+    Returns: (adapter, number of reads sampled in total, whether the adapter was stable or of all reads)
+    """
+    rng = random.Random(seed)
+    line_count, end = count_lines(path, number_of_lines)
+    sample_size = initial_sample_size
+    total_sampled = 0
+    # [(top-ranked suffix, fraction of the reads ending in a prefix of it, sample size), ...] of the agreeing samples
+    agreeing = []
+    while True:
+        if sample_size >= line_count:
+            with open(path, "r") as file:
+                reads = [line.strip() for line in islice(file, number_of_lines)]
+            suffix_tree = SuffixTree(reads, construction_method="ukkonen", collapse_duplicates=True)
+            _, most_common_suffix = suffix_tree.find_most_common_suffixes(top_k=1)
+            if verbose:
+                print(f"All {len(reads)} reads: {most_common_suffix}")
+            return most_common_suffix, total_sampled + len(reads), True
+        sample = sample_lines(path, sample_size, rng, end)
+        total_sampled += len(sample)
+        suffix_tree = SuffixTree(sample, construction_method="ukkonen", collapse_duplicates=True)
+        most_common_suffixes, most_common_suffix = suffix_tree.find_most_common_suffixes(top_k=1)
+        del suffix_tree
+        fraction = most_common_suffixes[0][0] / len(sample) if len(most_common_suffixes) > 0 else 0
+        if verbose:
+            print(f"Sample of {len(sample)} reads: {most_common_suffix} ({fraction:.3f} of the reads)")
+        if len(agreeing) > 0:
+            previous_suffix, previous_fraction, previous_size = agreeing[-1]
+            standard_error = sqrt(fraction * (1 - fraction) / len(sample)
+                                  + previous_fraction * (1 - previous_fraction) / previous_size)
+            starting_same = (most_common_suffix.startswith(previous_suffix)
+                             or previous_suffix.startswith(most_common_suffix))
+            if (most_common_suffix not in previous_suffix and previous_suffix not in most_common_suffix
+                    or starting_same and abs(fraction - previous_fraction) > confidence_z * standard_error):
+                agreeing = []
+        # keep the longer one of agreeing suffixes
+        if len(agreeing) > 0 and len(agreeing[-1][0]) > len(most_common_suffix):
+            most_common_suffix, fraction = agreeing[-1][0], agreeing[-1][1]
+        agreeing.append((most_common_suffix, fraction, len(sample)))
+        if len(agreeing) >= stable_rounds and len(most_common_suffix) > 0:
+            return most_common_suffix, total_sampled, True
+        if sample_size >= max_sample_size or len(sample) == 0:
+            return most_common_suffix, total_sampled, False
+        sample_size = min(max_sample_size, sample_size * growth_factor)
+
+
+class SuffixSketch:
+    __slots__ = ("min_length", "max_length", "capacity", "chunk_size", "width_bits", "counts", "multipliers",
+                 "candidates", "read_count")
+
+    def __init__(self, width_bits=20, depth=4, capacity=1000, min_length=1, max_length=None, chunk_size=100000,
+                 seed=None):
+        """
+        One-pass estimate of the most common suffixes without a tree, in memory independent of the number of reads: the
+        number of reads ending with each string of length min_length..max_length is counted in a count-min sketch, and
+        for every length the capacity suffixes with the highest estimates are kept as candidates. Reads are counted
+        chunk by chunk, the suffix hashes of a chunk are computed for all reads at once one length after the other, so
+        no suffix string is created except for the candidates.
+        Args:
+            width_bits: every row of the sketch has 2^width_bits counters
+            depth: number of rows of the sketch, an estimate is the minimum of its counters in all rows
+            capacity: number of candidate suffixes kept per length
+            min_length: shortest suffix counted
+            max_length: longest suffix counted, None for whole reads
+            chunk_size: number of reads counted at once
+            seed: seed of the hash functions, the same seed gives the same sketch for the same reads
+        """
+        self.min_length = min_length
+        self.max_length = max_length
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        self.width_bits = width_bits
+        self.counts = np.zeros((depth, 1 << width_bits), dtype=np.int64)
+        # multiply-shift hashing of the (64 bit) polynomial hashes of the suffixes, with odd multipliers
+        self.multipliers = np.random.RandomState(seed).randint(0, 1 << 62, size=depth, dtype=np.int64) \
+            .astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        self.candidates = {}  # {suffix length: {suffix: estimated number of reads ending with it}}
+        self.read_count = 0
+
+    def add_reads(self, reads):
+        """
+        Counts the suffixes of all reads of the iterable reads.
+        """
+        reads = iter(reads)
+        while True:
+            chunk = list(islice(reads, self.chunk_size))
+            if len(chunk) == 0:
+                break
+            self.read_count += len(chunk)
+            lengths = np.fromiter(map(len, chunk), dtype=np.int64, count=len(chunk))
+            width = int(lengths.max())
+            max_length = width if self.max_length is None else min(width, self.max_length)
+            # reads aligned at their ends, so column width - length holds the first symbol of the suffixes of length
+            codes = np.zeros((len(chunk), width), dtype=np.uint8)
+            read_ids = np.repeat(np.arange(len(chunk)), lengths)
+            read_starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+            codes[read_ids, np.arange(len(read_ids)) - read_starts + width - lengths[read_ids]] = \
+                np.frombuffer("".join(chunk).encode("ascii"), dtype=np.uint8)
+            hashes = np.zeros(len(chunk), dtype=np.uint64)
+            for length in range(1, max_length + 1):
+                hashes = hashes * HASH_BASE + codes[:, width - length]
+                if length >= self.min_length:
+                    read_ids = np.nonzero(lengths >= length)[0]
+                    self._add_suffixes(chunk, length, read_ids, hashes[read_ids])
+
+    def _add_suffixes(self, chunk, length, read_ids, hashes):
+        """counts the suffixes of length of chunk[read_ids] with their hashes and updates the candidates of length"""
+        unique_hashes, first_indices, counts = np.unique(hashes, return_index=True, return_counts=True)
+        indices = self._indices(unique_hashes)
+        for row, row_indices in enumerate(indices):
+            np.add.at(self.counts[row], row_indices, counts)
+        estimates = self._estimates_at(indices)
+        # suffixes of the chunk not among its capacity most common ones would be dropped from the candidates anyway
+        if len(estimates) > self.capacity:
+            top = np.argpartition(estimates, len(estimates) - self.capacity)[len(estimates) - self.capacity:]
+            first_indices, estimates = first_indices[top], estimates[top]
+        candidates = self.candidates.setdefault(length, {})
+        for read_id, estimate in zip(read_ids[first_indices].tolist(), estimates.tolist()):
+            read = chunk[read_id]
+            candidates[read[len(read) - length:]] = estimate
+        # estimates only grow, so candidates dropped now can't have been more common than the ones kept before
+        if len(candidates) > self.capacity:
+            self.candidates[length] = dict(heapq.nlargest(self.capacity, candidates.items(), key=itemgetter(1)))
+
+    def estimate(self, suffix):
+        """estimated number of reads ending with suffix, never less than the actual number"""
+        return int(self._estimates_at(self._indices(_suffix_hashes([suffix])))[0])
+
+    def most_common_suffixes(self, top_k=1000):
+        """
+        Like SuffixTree.find_most_common_suffixes: ranks the candidate suffixes by the estimated number of reads ending
+        in a prefix of them (of at least min_length), so a candidate continuing another one ranks higher and the
+        longest consistent adapter wins. A read ending in a prefix also ends in the borders of it, so only the
+        estimates of the prefixes without a border of at least min_length are summed up to count every read once.
+        Args:
+            top_k: number of suffixes to return
+        Returns: list of the form [(estimated number of reads ending in a prefix, suffix_length, suffix), ...] ordered
+        by count and then suffix length, the most common suffix
+        """
+        suffixes = {suffix for candidates in self.candidates.values() for suffix in candidates}
+        prefixes = list({suffix[:length] for suffix in suffixes
+                         for length in range(self.min_length, len(suffix) + 1)})
+        prefix_estimates = dict(zip(prefixes, self._estimates_at(self._indices(_suffix_hashes(prefixes))).tolist())) \
+            if len(prefixes) > 0 else {}
+        ranked_suffixes = heapq.nlargest(top_k, ((self._count_reads(suffix, prefix_estimates), len(suffix), suffix)
+                                                 for suffix in suffixes))
+        if len(ranked_suffixes) == 0:
+            return ranked_suffixes, ""
+        return ranked_suffixes, ranked_suffixes[0][2]
+
+    def _count_reads(self, suffix, prefix_estimates):
+        borders = compute_border_table(suffix)
+        return sum(prefix_estimates[suffix[:length]] for length in range(self.min_length, len(suffix) + 1)
+                   if borders[length] < self.min_length)
+
+    def _indices(self, hashes):
+        return [(hashes * multiplier) >> np.uint64(64 - self.width_bits) for multiplier in self.multipliers]
+
+    def _estimates_at(self, indices):
+        return np.min([self.counts[row][row_indices] for row, row_indices in enumerate(indices)], axis=0)
+
+
+def _suffix_hashes(suffixes):
+    """
+    The hashes SuffixSketch.add_reads computes for the suffixes: the polynomial in HASH_BASE (modulo 2^64) of their
+    symbol codes from the last to the first symbol, so the hash of a suffix extends the one of the suffix a symbol
+    shorter.
+    """
+    hashes = []
+    for suffix in suffixes:
+        suffix_hash = 0
+        for code in reversed(suffix.encode("ascii")):
+            suffix_hash = (suffix_hash * HASH_BASE_VALUE + code) & HASH_MASK
+        hashes.append(suffix_hash)
+    return np.array(hashes, dtype=np.uint64)
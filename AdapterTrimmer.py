@@ -0,0 +1,320 @@
+from collections import Counter, deque
+from itertools import islice
+from math import floor
+import numpy as np
+
+
+def allowed_mismatch_counts(adapter_length, max_mismatch_rate):
+    """
+    Mismatch counts allowed for the overlaps with an adapter as in SuffixTree's mismatch search: at most
+    max_mismatch_rate of the overlap length and of the adapter length including termination symbol.
+    Returns: list of the allowed mismatch count of every overlap length 1..adapter_length, at index length - 1
+    """
+    # maximally possible mismatch count no matter the length of the match
+    max_mismatch_count = floor((adapter_length + 1) * max_mismatch_rate)
+    return [max(mismatch_count for mismatch_count in range(max_mismatch_count + 1)
+                if mismatch_count / match_length <= max_mismatch_rate)
+            for match_length in range(1, adapter_length + 1)]
+
+
+def encode_reads(reads):
+    """
+    Encodes equally long reads as the rows of a uint8 matrix of their ASCII codes.
+    Args:
+        reads: list of strings, all of the same length
+    Returns: numpy array of shape (number of reads, read length)
+    """
+    if len(reads) == 0:
+        return np.zeros((0, 0), dtype=np.uint8)
+    read_length = len(reads[0])
+    text = "".join(reads).encode("ascii")
+    if len(text) != len(reads) * read_length:
+        raise ValueError("all reads must have the same length")
+    return np.frombuffer(text, dtype=np.uint8).reshape(len(reads), read_length)
+
+
+class AdapterTrimmer:
+    __slots__ = ("adapter", "adapter_codes", "chunk_size")
+
+    def __init__(self, adapter, chunk_size=100000):
+        """
+        Tree-free suffix-prefix matching of many equally long reads against one known adapter: the reads are encoded
+        chunk by chunk into a matrix, and each overlap length is compared for the whole chunk at once. Gives the same
+        match lengths as SuffixTree.find_suffix_matches_for_prefix(_with_mismatches) with the adapter as prefix string.
+        Args:
+            adapter: adapter string whose prefixes are matched against the suffixes of the reads
+            chunk_size: number of reads encoded at once, bounds the memory used
+        """
+        self.adapter = adapter
+        self.adapter_codes = np.frombuffer(adapter.encode("ascii"), dtype=np.uint8)
+        self.chunk_size = chunk_size
+
+    def match_lengths(self, reads, max_mismatch_rate=0):
+        """
+        Finds the length of the longest suffix of every read that matches a prefix of the adapter with a certain
+        allowed mismatch percentage.
+        Args:
+            reads: iterable of strings, all reads in a chunk must have the same length
+            max_mismatch_rate: number in 0..1 specifying the maximally allowed mismatch percentage, 0 for exact matches
+        Returns: numpy array of the maximally matched length of every read, in the order of the reads
+        """
+        reads = iter(reads)
+        chunks_match_lengths = []
+        while True:
+            chunk = list(islice(reads, self.chunk_size))
+            if len(chunk) == 0:
+                break
+            chunks_match_lengths.append(self._match_lengths_of_chunk(encode_reads(chunk), max_mismatch_rate))
+        if len(chunks_match_lengths) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.concatenate(chunks_match_lengths)
+
+    def _match_lengths_of_chunk(self, reads_matrix, max_mismatch_rate):
+        number_of_reads, read_length = reads_matrix.shape
+        adapter_codes = self.adapter_codes
+        allowed_mismatches_per_length = allowed_mismatch_counts(len(adapter_codes), max_mismatch_rate)
+        match_lengths = np.zeros(number_of_reads, dtype=np.int32)
+        # ascending lengths, so the last one matching is the longest
+        for match_length in range(1, min(read_length, len(adapter_codes)) + 1):
+            allowed_mismatches = allowed_mismatches_per_length[match_length - 1]
+            differences = reads_matrix[:, read_length - match_length:] != adapter_codes[:match_length]
+            if allowed_mismatches == 0:
+                matches = ~differences.any(axis=1)
+            else:
+                matches = np.count_nonzero(differences, axis=1) <= allowed_mismatches
+            match_lengths[matches] = match_length
+        return match_lengths
+
+
+def compute_border_table(pattern):
+    """
+    KMP failure function: borders[q] is the length of the longest proper border (prefix that is also a suffix) of
+    pattern[:q], for q in 0..len(pattern)
+    """
+    borders = [0] * (len(pattern) + 1)
+    border = 0
+    for q in range(1, len(pattern)):
+        while border > 0 and pattern[q] != pattern[border]:
+            border = borders[border]
+        if pattern[q] == pattern[border]:
+            border += 1
+        borders[q + 1] = border
+    return borders
+
+
+class StreamingAdapterTrimmer:
+    __slots__ = ("adapter", "borders", "field_width", "field_mask", "guards", "mismatch_vectors",
+                 "all_mismatch_vector", "thresholds")
+
+    def __init__(self, adapter):
+        """
+        Suffix-prefix matching of reads against one known adapter one read at a time, in O(read length) and without
+        storing the reads. Exact matches follow the KMP automaton of the adapter. For mismatches, the mismatch counts of
+        all overlap lengths are kept as fields of one integer (shift-add): each symbol shifts the fields one length
+        further and adds its precomputed mismatch vector, and the fields within the allowed counts are found with one
+        subtraction from a threshold vector. Gives the same match lengths as AdapterTrimmer.
+        Args:
+            adapter: adapter string whose prefixes are matched against the suffixes of the reads
+        """
+        self.adapter = adapter
+        self.borders = compute_border_table(adapter)
+        # field j holds the mismatch count of the overlap of length j + 1, the top bit of each field is a guard bit
+        self.field_width = len(adapter).bit_length() + 1
+        self.field_mask = (1 << (self.field_width * len(adapter))) - 1
+        self.guards = sum(1 << (self.field_width * (j + 1) - 1) for j in range(len(adapter)))
+        self.all_mismatch_vector = sum(1 << (self.field_width * j) for j in range(len(adapter)))
+        # mismatch vector of a symbol: 1 in the fields of the adapter positions with another symbol
+        self.mismatch_vectors = {symbol: sum(1 << (self.field_width * j) for j in range(len(adapter))
+                                             if adapter[j] != symbol)
+                                 for symbol in set(adapter)}
+        self.thresholds = {}  # {max_mismatch_rate: allowed mismatch count of each overlap length as fields}
+
+    def match_length(self, read, max_mismatch_rate=0):
+        """
+        Finds the length of the longest suffix of the read that matches a prefix of the adapter with a certain allowed
+        mismatch percentage.
+        Args:
+            read: string to be matched
+            max_mismatch_rate: number in 0..1 specifying the maximally allowed mismatch percentage, 0 for exact matches
+        Returns: maximally matched length
+        """
+        if len(self.adapter) == 0:
+            return 0
+        if max_mismatch_rate == 0:
+            return self._exact_match_length(read)
+        thresholds = self.thresholds.get(max_mismatch_rate)
+        if thresholds is None:
+            thresholds = self.thresholds[max_mismatch_rate] = self._compute_thresholds(max_mismatch_rate)
+        field_width, field_mask = self.field_width, self.field_mask
+        mismatch_vectors, all_mismatch_vector = self.mismatch_vectors, self.all_mismatch_vector
+        mismatch_counts = 0
+        for symbol in read:
+            mismatch_counts = ((mismatch_counts << field_width)
+                               + mismatch_vectors.get(symbol, all_mismatch_vector)) & field_mask
+        # guard bits survive the subtraction in the fields within their threshold, overlaps aren't longer than the read
+        matches = ((thresholds | self.guards) - mismatch_counts) & self.guards \
+            & ((1 << (field_width * min(len(read), len(self.adapter)))) - 1)
+        return matches.bit_length() // field_width
+
+    def match_lengths(self, reads, max_mismatch_rate=0):
+        """
+        Returns: generator of the maximally matched length of every read of the iterable reads, see match_length
+        """
+        return (self.match_length(read, max_mismatch_rate) for read in reads)
+
+    def remaining_length_counts(self, reads, max_mismatch_rate=0):
+        """
+        Trims every read of the iterable reads and counts the lengths remaining, in constant memory.
+        Returns: Counter {remaining length: number of reads}
+        """
+        return Counter(len(read) - self.match_length(read, max_mismatch_rate) for read in reads)
+
+    def _exact_match_length(self, read):
+        adapter, borders = self.adapter, self.borders
+        matched_length = 0
+        for symbol in read:
+            while matched_length > 0 and (matched_length == len(adapter) or adapter[matched_length] != symbol):
+                matched_length = borders[matched_length]
+            if adapter[matched_length] == symbol:
+                matched_length += 1
+        return matched_length
+
+    def _compute_thresholds(self, max_mismatch_rate):
+        thresholds = 0
+        for j, allowed_mismatches in enumerate(allowed_mismatch_counts(len(self.adapter), max_mismatch_rate)):
+            thresholds |= allowed_mismatches << (self.field_width * j)
+        return thresholds
+
+
+class MultiAdapterTrimmer:
+    __slots__ = ("adapters", "max_mismatch_rates", "transitions", "state_matches", "exact_adapter_ids",
+                 "tolerant_adapter_ids", "field_width", "field_offsets", "field_mask", "shift_mask", "guards",
+                 "thresholds", "mismatch_vectors", "all_mismatch_vector", "valid_fields")
+
+    def __init__(self, adapters, max_mismatch_rates=0):
+        """
+        Suffix-prefix matching of reads against several adapters at once, scanning every read once.
+        Adapters matched exactly share an Aho-Corasick automaton over all their prefixes: after a read, its state is the
+        longest suffix of the read that is a prefix of any of them. Adapters with mismatches allowed share one
+        shift-add integer as in StreamingAdapterTrimmer, with the fields of all of them side by side and a threshold
+        vector holding the allowed mismatch counts of each of them.
+        Args:
+            adapters: list of adapter strings
+            max_mismatch_rates: number in 0..1 specifying the maximally allowed mismatch percentage for all adapters,
+                or list of one such number per adapter
+        """
+        self.adapters = list(adapters)
+        if isinstance(max_mismatch_rates, (int, float)):
+            max_mismatch_rates = [max_mismatch_rates] * len(self.adapters)
+        if len(max_mismatch_rates) != len(self.adapters):
+            raise ValueError("there must be one mismatch rate per adapter")
+        self.max_mismatch_rates = list(max_mismatch_rates)
+        self.exact_adapter_ids = [adapter_id for adapter_id, adapter in enumerate(self.adapters)
+                                  if self.max_mismatch_rates[adapter_id] == 0 and len(adapter) > 0]
+        self.tolerant_adapter_ids = [adapter_id for adapter_id, adapter in enumerate(self.adapters)
+                                     if self.max_mismatch_rates[adapter_id] > 0 and len(adapter) > 0]
+        self._build_automaton()
+        self._build_mismatch_fields()
+
+    def _build_automaton(self):
+        # trie of all prefixes of the exact adapters, state 0 is the root
+        children = [{}]
+        # (adapter_id, overlap length) of every state, the first adapter having its string as prefix
+        self.state_matches = [(None, 0)]
+        for adapter_id in self.exact_adapter_ids:
+            state = 0
+            for symbol in self.adapters[adapter_id]:
+                if symbol not in children[state]:
+                    children[state][symbol] = len(children)
+                    children.append({})
+                    self.state_matches.append((adapter_id, self.state_matches[state][1] + 1))
+                state = children[state][symbol]
+        # complete the transitions with the failure links breadth first, symbols of no adapter lead back to the root
+        symbols = {symbol for adapter_id in self.exact_adapter_ids for symbol in self.adapters[adapter_id]}
+        self.transitions = [None] * len(children)
+        self.transitions[0] = {symbol: children[0].get(symbol, 0) for symbol in symbols}
+        # [(state, failure state), ...]
+        states_left = deque((child, 0) for child in children[0].values())
+        while len(states_left) > 0:
+            state, failure = states_left.popleft()
+            self.transitions[state] = dict(self.transitions[failure])
+            for symbol, child in children[state].items():
+                self.transitions[state][symbol] = child
+                states_left.append((child, self.transitions[failure][symbol]))
+
+    def _build_mismatch_fields(self):
+        adapters = self.adapters
+        # field offset + j holds the mismatch count of the overlap of length j + 1 with an adapter
+        self.field_width = max((len(adapters[adapter_id]) for adapter_id in self.tolerant_adapter_ids),
+                               default=0).bit_length() + 1
+        self.field_offsets = []
+        field_count = 0
+        for adapter_id in self.tolerant_adapter_ids:
+            self.field_offsets.append(field_count)
+            field_count += len(adapters[adapter_id])
+        width = self.field_width
+        self.field_mask = (1 << (width * field_count)) - 1
+        # the first field of an adapter doesn't take over the last one of the adapter before
+        self.shift_mask = self.field_mask & ~sum((1 << width) - 1 << (width * offset) for offset in self.field_offsets)
+        self.guards = sum(1 << (width * (field + 1) - 1) for field in range(field_count))
+        self.thresholds = 0
+        self.all_mismatch_vector = 0
+        self.mismatch_vectors = {}
+        for adapter_id, offset in zip(self.tolerant_adapter_ids, self.field_offsets):
+            adapter = adapters[adapter_id]
+            allowed_counts = allowed_mismatch_counts(len(adapter), self.max_mismatch_rates[adapter_id])
+            for j in range(len(adapter)):
+                self.thresholds |= allowed_counts[j] << (width * (offset + j))
+                self.all_mismatch_vector |= 1 << (width * (offset + j))
+        for symbol in {symbol for adapter_id in self.tolerant_adapter_ids for symbol in adapters[adapter_id]}:
+            self.mismatch_vectors[symbol] = self.all_mismatch_vector
+            for adapter_id, offset in zip(self.tolerant_adapter_ids, self.field_offsets):
+                for j, adapter_symbol in enumerate(adapters[adapter_id]):
+                    if adapter_symbol == symbol:
+                        self.mismatch_vectors[symbol] &= ~(1 << (width * (offset + j)))
+        self.valid_fields = {}  # {read length: guard bits of the overlaps not longer than the read}
+
+    def match(self, read):
+        """
+        Finds the adapter with the longest suffix-prefix match with the read, each with its own allowed mismatch
+        percentage, the first adapter among equally long matches.
+        Args:
+            read: string to be matched
+        Returns: (adapter id or None without any match, maximally matched length)
+        """
+        transitions = self.transitions
+        field_width, shift_mask = self.field_width, self.shift_mask
+        mismatch_vectors, all_mismatch_vector = self.mismatch_vectors, self.all_mismatch_vector
+        state = 0
+        mismatch_counts = 0
+        for symbol in read:
+            state = transitions[state].get(symbol, 0)
+            mismatch_counts = ((mismatch_counts << field_width) & shift_mask) \
+                + mismatch_vectors.get(symbol, all_mismatch_vector)
+        best_adapter_id, best_length = self.state_matches[state]
+        if len(self.tolerant_adapter_ids) == 0:
+            return best_adapter_id, best_length
+        valid_fields = self.valid_fields.get(len(read))
+        if valid_fields is None:
+            valid_fields = self.valid_fields[len(read)] = self._valid_fields(len(read))
+        # guard bits survive the subtraction in the fields within their threshold
+        matches = ((self.thresholds | self.guards) - mismatch_counts) & valid_fields
+        for adapter_id, offset in zip(self.tolerant_adapter_ids, self.field_offsets):
+            adapter_fields_mask = (1 << (field_width * len(self.adapters[adapter_id]))) - 1
+            length = ((matches >> (field_width * offset)) & adapter_fields_mask).bit_length() // field_width
+            if length > best_length or (length == best_length and length > 0 and adapter_id < best_adapter_id):
+                best_adapter_id, best_length = adapter_id, length
+        return best_adapter_id, best_length
+
+    def matches(self, reads):
+        """
+        Returns: generator of the (adapter id, maximally matched length) of every read of the iterable reads, see match
+        """
+        return (self.match(read) for read in reads)
+
+    def _valid_fields(self, read_length):
+        valid_fields = 0
+        for adapter_id, offset in zip(self.tolerant_adapter_ids, self.field_offsets):
+            for j in range(min(read_length, len(self.adapters[adapter_id]))):
+                valid_fields |= 1 << (self.field_width * (offset + j + 1) - 1)
+        return valid_fields
@@ -0,0 +1,520 @@
+import json
+import mmap as mmap_module
+import sys
+from array import array
+from bisect import bisect_left
+from SuffixTree import SuffixTree, EncodedStrings
+
+NO_NODE = -1  # marks missing first child, next sibling, parent, suffix link or leaf payload
+ROOT_ID = 0
+
+FILE_MAGIC = b"SFXTREE1"
+TEXT_ALIGNMENT = 65536  # mmap offsets must be a multiple of the allocation granularity, 64 KiB on Windows
+COLUMN_ALIGNMENT = 8
+# columns of a CompactSuffixTree in the order they are written
+NODE_COLUMNS = ("starts", "ends", "string_ids", "symbols", "parents", "first_children", "next_siblings",
+                "path_label_lengths", "suffix_links", "payload_heads", "payload_string_ids", "payload_string_pos",
+                "payload_nexts")
+
+
+class CompactNode:
+    __slots__ = ("tree", "id")
+
+    def __init__(self, tree, node_id):
+        """
+        Node interface on top of the columns of a CompactSuffixTree, see Node for the meaning of the attributes.
+        Only holds the node id, so it can be thrown away and recreated at any time.
+        Args:
+            tree: CompactSuffixTree holding the columns
+            node_id: row of this node in the columns
+        """
+        self.tree = tree
+        self.id = node_id
+
+    def __eq__(self, other):
+        return isinstance(other, CompactNode) and self.tree is other.tree and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"[{self.start}:{self.end}]"
+
+    @property
+    def start(self):
+        return self.tree.starts[self.id]
+
+    @property
+    def end(self):
+        return self.tree.ends[self.id]
+
+    @property
+    def path_label_length(self):
+        return self.tree.path_label_lengths[self.id]
+
+    @property
+    def parent(self):
+        return self.tree.get_node(self.tree.parents[self.id])
+
+    @property
+    def string_id(self):
+        tree = self.tree
+        if tree.payload_heads[self.id] == NO_NODE:
+            return None
+        return CompactPayload(tree, self.id, tree.payload_string_ids)
+
+    @property
+    def string_pos(self):
+        tree = self.tree
+        if tree.payload_heads[self.id] == NO_NODE:
+            return None
+        return CompactPayload(tree, self.id, tree.payload_string_pos)
+
+    @property
+    def children(self):
+        """new {first symbol code of edge label: child} dict, traversals use has_children and iter_children instead"""
+        tree = self.tree
+        children = {}
+        child = tree.first_children[self.id]
+        while child != NO_NODE:
+            children[tree.symbols[child]] = tree.get_node(child)
+            child = tree.next_siblings[child]
+        return children
+
+    @property
+    def terminal_edge_ids(self):
+        return self.tree.terminal_edge_ids.get(self.id)
+
+    @property
+    def leaf_count(self):
+        return self.tree.leaf_counts[self.id]
+
+    @leaf_count.setter
+    def leaf_count(self, count):
+        self.tree.leaf_counts[self.id] = count
+
+    @property
+    def string_count(self):
+        return self.tree.string_counts[self.id]
+
+    @string_count.setter
+    def string_count(self, count):
+        self.tree.string_counts[self.id] = count
+
+    @property
+    def suffix_link(self):
+        return self.tree.get_node(self.tree.suffix_links[self.id])
+
+    @suffix_link.setter
+    def suffix_link(self, node):
+        self.tree.suffix_links[self.id] = node.id
+
+    def add_child(self, symbol, child: "CompactNode"):
+        """add child whose edge label starts with symbol, replacing the current one for symbol, and return it"""
+        tree = self.tree
+        # find child to replace or last child to append to the sibling list
+        previous_child = NO_NODE
+        current_child = tree.first_children[self.id]
+        while current_child != NO_NODE and tree.symbols[current_child] != symbol:
+            previous_child = current_child
+            current_child = tree.next_siblings[current_child]
+        if previous_child == NO_NODE:
+            tree.first_children[self.id] = child.id
+        else:
+            tree.next_siblings[previous_child] = child.id
+        if current_child != NO_NODE:
+            tree.next_siblings[child.id] = tree.next_siblings[current_child]
+            tree.next_siblings[current_child] = NO_NODE
+        else:
+            tree.next_siblings[child.id] = NO_NODE
+        tree.symbols[child.id] = symbol
+        tree.parents[child.id] = self.id
+        child.update_path_label_length()
+        return child
+
+    def get_child(self, symbol):
+        """returns child whose edge label starts with symbol or None, only compares the cached first symbols"""
+        tree = self.tree
+        child = tree.first_children[self.id]
+        while child != NO_NODE and tree.symbols[child] != symbol:
+            child = tree.next_siblings[child]
+        return tree.get_node(child)
+
+    def has_children(self):
+        return self.tree.first_children[self.id] != NO_NODE
+
+    def iter_children(self):
+        """generator of (first symbol code of edge label, child) walking the sibling list, without building children"""
+        tree = self.tree
+        child = tree.first_children[self.id]
+        while child != NO_NODE:
+            yield tree.symbols[child], tree.get_node(child)
+            child = tree.next_siblings[child]
+
+    def add_string_to_leaf(self, string_id, string_pos):
+        self.tree.add_payload(self.id, string_id, string_pos)
+
+    def set_start(self, start):
+        self.tree.starts[self.id] = start
+        self.update_path_label_length()
+
+    def set_end(self, end):
+        self.tree.ends[self.id] = end
+        self.update_path_label_length()
+
+    def update_path_label_length(self):
+        tree = self.tree
+        tree.path_label_lengths[self.id] = (tree.path_label_lengths[tree.parents[self.id]]
+                                            + tree.ends[self.id] - tree.starts[self.id])
+
+    def add_terminal_edge_ids(self, ids):
+        """pass iterable of string ids that have terminal edges outgoing from this node"""
+        self.tree.terminal_edge_ids.setdefault(self.id, set()).update(ids)
+
+
+class CompactPayload:
+    __slots__ = ("tree", "node_id", "column")
+
+    def __init__(self, tree, node_id, column):
+        """
+        read-only list view on the string ids or string positions of a leaf, so that e.g. string_id[0] of the leaf
+        of the termination symbol does not need to walk all strings
+        """
+        self.tree = tree
+        self.node_id = node_id
+        self.column = column
+
+    def __len__(self):
+        return sum(1 for _ in self.tree.iter_payload(self.node_id))
+
+    def __iter__(self):
+        column = self.column
+        return (column[payload] for payload in self.tree.iter_payload(self.node_id))
+
+    def __getitem__(self, i):
+        if i == 0 and self.column is self.tree.payload_string_ids:
+            return self.tree.string_ids[self.node_id]  # string id of the first payload entry
+        return list(self)[i]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class CompactTerminalEdgeIds:
+    __slots__ = ("node_ids", "offsets", "string_ids")
+
+    def __init__(self, node_ids, offsets, string_ids):
+        """
+        read-only {node_id: set of string ids} on top of the terminal edge columns of a saved tree, the ids of
+        node_ids[i] are string_ids[offsets[i]:offsets[i + 1]]
+        """
+        self.node_ids = node_ids  # sorted
+        self.offsets = offsets
+        self.string_ids = string_ids
+
+    def get(self, node_id, default=None):
+        i = bisect_left(self.node_ids, node_id)
+        if i == len(self.node_ids) or self.node_ids[i] != node_id:
+            return default
+        return set(self.string_ids[self.offsets[i]:self.offsets[i + 1]])
+
+    def items(self):
+        return ((self.node_ids[i], set(self.string_ids[self.offsets[i]:self.offsets[i + 1]]))
+                for i in range(len(self.node_ids)))
+
+
+class CompactNodeList:
+    __slots__ = ("tree", "node_ids")
+
+    def __init__(self, tree):
+        """list of nodes only storing their ids, used for the leaves of a CompactSuffixTree"""
+        self.tree = tree
+        self.node_ids = array("i")
+
+    def append(self, node):
+        self.node_ids.append(node.id)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __getitem__(self, i):
+        return self.tree.get_node(self.node_ids[i])
+
+    def __iter__(self):
+        get_node = self.tree.get_node
+        return (get_node(node_id) for node_id in self.node_ids)
+
+
+class CompactSuffixTree(SuffixTree):
+    """
+    SuffixTree keeping all nodes in flat array columns indexed by node id instead of one Node object per node.
+    Children are stored as first-child/next-sibling lists with a cached first symbol per node, the
+    (string_id, string_pos) entries of the leaves as linked payload lists. All construction and query methods of
+    SuffixTree work unchanged on top of it, the nodes they see are CompactNode views that are created on access.
+    """
+    __slots__ = ("starts", "ends", "string_ids", "symbols", "parents", "first_children", "next_siblings",
+                 "path_label_lengths", "suffix_links", "payload_heads", "payload_string_ids", "payload_string_pos",
+                 "payload_nexts", "terminal_edge_ids", "leaf_counts", "string_counts")
+
+    def _init_nodes(self):
+        # one entry per node
+        self.starts = array("I")  # edge label positions in the text of the tree
+        self.ends = array("I")
+        self.string_ids = array("i")  # first string id of leaves
+        self.symbols = array("B")  # first symbol code of the edge label, the key of the node in its parent's children
+        self.parents = array("i")
+        self.first_children = array("i")
+        self.next_siblings = array("i")
+        self.path_label_lengths = array("i")
+        self.suffix_links = array("i")
+        self.payload_heads = array("i")  # first payload entry of leaves, NO_NODE for internal nodes
+        # one entry per (string_id, string_pos) of a leaf, most recently added first
+        self.payload_string_ids = array("i")
+        self.payload_string_pos = array("i")
+        self.payload_nexts = array("i")
+        # {node_id: set of string ids}, only for nodes with terminal edges
+        self.terminal_edge_ids = {}
+        # one entry per node, filled by annotate
+        self.leaf_counts = array("i")
+        self.string_counts = array("i")
+
+        self.root = self._create_node()
+        self.leaves = CompactNodeList(self)
+
+    def _create_node(self, start=None, end=None, string_id=None, string_pos=None):
+        node_id = len(self.starts)
+        self.starts.append(start if start is not None else 0)
+        self.ends.append(end if end is not None else 0)
+        self.string_ids.append(string_id if string_id is not None else NO_NODE)
+        self.symbols.append(0)
+        self.parents.append(NO_NODE)
+        self.first_children.append(NO_NODE)
+        self.next_siblings.append(NO_NODE)
+        self.path_label_lengths.append(0)
+        self.suffix_links.append(NO_NODE)
+        self.payload_heads.append(NO_NODE)
+        if string_pos is not None:
+            self.add_payload(node_id, string_id, string_pos)
+        if node_id == ROOT_ID:
+            return CompactNode(self, node_id)
+        return self.get_node(node_id)
+
+    def get_node(self, node_id):
+        """returns the node view for node_id, the same object for the root so that identity checks keep working"""
+        if node_id == NO_NODE:
+            return None
+        if node_id == ROOT_ID:
+            return self.root
+        return CompactNode(self, node_id)
+
+    def add_payload(self, node_id, string_id, string_pos):
+        self.payload_string_ids.append(string_id)
+        self.payload_string_pos.append(string_pos)
+        self.payload_nexts.append(self.payload_heads[node_id])
+        self.payload_heads[node_id] = len(self.payload_nexts) - 1
+
+    def iter_payload(self, node_id):
+        """payload entries of leaf node_id in the order they were added"""
+        payloads = []
+        payload = self.payload_heads[node_id]
+        while payload != NO_NODE:
+            payloads.append(payload)
+            payload = self.payload_nexts[payload]
+        return reversed(payloads)
+
+    def annotate(self):
+        self.leaf_counts = array("i", [0]) * len(self.starts)
+        self.string_counts = array("i", [0]) * len(self.starts)
+        super().annotate()
+
+    def memory_usage(self):
+        """bytes used by the node and payload columns, the text with its string offsets and the terminal edge ids"""
+        columns = (self.starts, self.ends, self.string_ids, self.symbols, self.parents, self.first_children,
+                   self.next_siblings, self.path_label_lengths, self.suffix_links, self.payload_heads,
+                   self.payload_string_ids, self.payload_string_pos, self.payload_nexts, self.strings.offsets)
+        if isinstance(self.terminal_edge_ids, CompactTerminalEdgeIds):
+            columns += (self.terminal_edge_ids.node_ids, self.terminal_edge_ids.offsets,
+                        self.terminal_edge_ids.string_ids)
+            terminal_edge_bytes = 0
+        else:
+            # the dict of sets, the string ids in them are mostly small ints shared by the interpreter
+            terminal_edge_bytes = sys.getsizeof(self.terminal_edge_ids) + sum(
+                sys.getsizeof(string_ids) for string_ids in self.terminal_edge_ids.values())
+        return sum(column.itemsize * len(column) for column in columns) + len(self.text) + terminal_edge_bytes
+
+    def bytes_per_suffix(self):
+        """memory_usage divided by the number of suffixes (including the termination symbol ones) in the tree"""
+        return self.memory_usage() / max(1, len(self.payload_string_ids))
+
+    @classmethod
+    def from_tree(cls, tree):
+        """CompactSuffixTree with the nodes of tree in the same child and leaf order, sharing its strings"""
+        compact = cls(construction_method=tree.construction_method, track_terminal_edges=tree.track_terminal_edges,
+                      max_depth=tree.max_depth, collapse_duplicates=tree.collapse_duplicates)
+        compact.strings, compact.text = tree.strings, tree.text
+        compact.sequence_ids, compact.multiplicities, compact.duplicate_ids = (tree.sequence_ids, tree.multiplicities,
+                                                                               tree.duplicate_ids)
+        node_ids = {id(tree.root): ROOT_ID}  # {id(Node): node_id}
+        linked_nodes = []  # nodes with suffix link
+        nodes_left = [tree.root]
+        while len(nodes_left) > 0:
+            node = nodes_left.pop()
+            compact_node = compact.get_node(node_ids[id(node)])
+            if node.terminal_edge_ids:
+                compact_node.add_terminal_edge_ids(node.terminal_edge_ids)
+            if node.suffix_link is not None:
+                linked_nodes.append(node)
+            for symbol, child in node.children.items():
+                if child.string_id is None:
+                    compact_child = compact._create_node(child.start, child.end)
+                else:
+                    compact_child = compact._create_node(child.start, child.end, child.string_id[0],
+                                                         child.string_pos[0])
+                    for string_id, string_pos in zip(child.string_id[1:], child.string_pos[1:]):
+                        compact_child.add_string_to_leaf(string_id, string_pos)
+                compact_node.add_child(symbol, compact_child)
+                node_ids[id(child)] = compact_child.id
+                nodes_left.append(child)
+        for node in linked_nodes:
+            compact.suffix_links[node_ids[id(node)]] = node_ids[id(node.suffix_link)]
+        for leaf in tree.leaves:
+            compact.leaves.node_ids.append(node_ids[id(leaf)])
+        if tree.annotated:
+            compact.annotate()
+        return compact
+
+    def save(self, path, include_strings=True):
+        """
+        Writes the tree as one binary file: FILE_MAGIC, the length of the json header as 8 byte little endian number,
+        the json header with settings and (typecode, offset, length) of every column, then the text at a multiple of
+        TEXT_ALIGNMENT followed by the columns, so that load can map all of them into memory without parsing.
+        Args:
+            path: file to write
+            include_strings: write the text and the per string columns (offsets, multiplicities and duplicates), leave
+                them out for trees sharing their strings with other trees, load then needs them passed in
+        """
+        terminal_node_ids, terminal_offsets, terminal_string_ids = array("i"), array("q", [0]), array("i")
+        for node_id, string_ids in sorted(self.terminal_edge_ids.items()):
+            terminal_node_ids.append(node_id)
+            terminal_string_ids.extend(sorted(string_ids))
+            terminal_offsets.append(len(terminal_string_ids))
+        columns = {}
+        if include_strings:
+            duplicate_first_ids, duplicate_offsets, duplicate_ids = array("i"), array("q", [0]), array("i")
+            for string_id, string_duplicate_ids in self.duplicate_ids.items():
+                duplicate_first_ids.append(string_id)
+                duplicate_ids.extend(string_duplicate_ids)
+                duplicate_offsets.append(len(duplicate_ids))
+            columns.update({
+                "string_offsets": self.strings.offsets, "multiplicities": self.multiplicities,
+                "duplicate_first_ids": duplicate_first_ids, "duplicate_offsets": duplicate_offsets,
+                "duplicate_ids": duplicate_ids,
+            })
+        columns.update({
+            "leaves": self.leaves.node_ids,
+            "terminal_node_ids": terminal_node_ids, "terminal_offsets": terminal_offsets,
+            "terminal_string_ids": terminal_string_ids,
+            "leaf_counts": self.leaf_counts, "string_counts": self.string_counts,
+        })
+        columns.update((name, getattr(self, name)) for name in NODE_COLUMNS)
+        text = self.text if include_strings else b""
+        # {name: (typecode, offset relative to the text, length)}
+        layout = {}
+        position = len(text)
+        for name, column in columns.items():
+            position += -position % COLUMN_ALIGNMENT
+            layout[name] = (column.typecode, position, len(column))
+            position += len(column) * column.itemsize
+        header = json.dumps({
+            "byteorder": sys.byteorder, "construction_method": self.construction_method,
+            "track_terminal_edges": self.track_terminal_edges, "max_depth": self.max_depth,
+            "collapse_duplicates": self.collapse_duplicates, "annotated": self.annotated,
+            "include_strings": include_strings, "text_length": len(text), "columns": layout,
+        }).encode("ascii")
+        text_offset = len(FILE_MAGIC) + 8 + len(header)
+        text_offset += -text_offset % TEXT_ALIGNMENT
+        with open(path, "wb") as file:
+            file.write(FILE_MAGIC)
+            file.write(len(header).to_bytes(8, "little"))
+            file.write(header)
+            file.write(bytes(text_offset - file.tell()))
+            file.write(text)
+            for name, column in columns.items():
+                file.write(bytes(text_offset + layout[name][1] - file.tell()))
+                file.write(column)
+
+    @classmethod
+    def load(cls, path, mmap=True, strings=None, multiplicities=None):
+        """
+        Loads a tree written by save.
+        Args:
+            path: file written by save
+            mmap: map the text and columns into memory instead of reading them, the tree is usable right away and
+                only the pages queries touch are read, but it is read-only: no strings can be added
+            strings: EncodedStrings of a tree saved without its strings
+            multiplicities: multiplicities of the strings of a tree saved without its strings
+        Returns: CompactSuffixTree
+        """
+        with open(path, "rb") as file:
+            if file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise ValueError(f"{path} is no saved suffix tree")
+            header_length = int.from_bytes(file.read(8), "little")
+            header = json.loads(file.read(header_length).decode("ascii"))
+            if header["byteorder"] != sys.byteorder:
+                raise ValueError(f"{path} was saved on a machine with {header['byteorder']} byte order")
+            text_offset = len(FILE_MAGIC) + 8 + header_length
+            text_offset += -text_offset % TEXT_ALIGNMENT
+            if mmap:
+                # the maps stay open as long as the text and column views exist
+                data = memoryview(mmap_module.mmap(file.fileno(), 0, access=mmap_module.ACCESS_READ))[text_offset:]
+                if header["text_length"] > 0:
+                    text = mmap_module.mmap(file.fileno(), header["text_length"], access=mmap_module.ACCESS_READ,
+                                            offset=text_offset)
+                else:
+                    text = bytearray()
+            else:
+                file.seek(text_offset)
+                data = memoryview(file.read())
+                text = bytearray(data[:header["text_length"]])
+        columns = {}
+        for name, (typecode, offset, length) in header["columns"].items():
+            column_data = data[offset:offset + length * array(typecode).itemsize]
+            if mmap:
+                columns[name] = column_data.cast(typecode)
+            else:
+                columns[name] = array(typecode)
+                columns[name].frombytes(column_data)
+
+        tree = cls(construction_method=header["construction_method"],
+                   track_terminal_edges=header["track_terminal_edges"], max_depth=header["max_depth"],
+                   collapse_duplicates=header["collapse_duplicates"])
+        for name in NODE_COLUMNS:
+            setattr(tree, name, columns[name])
+        tree.leaves.node_ids = columns["leaves"]
+        tree.leaf_counts, tree.string_counts = columns["leaf_counts"], columns["string_counts"]
+        tree.annotated = header["annotated"]
+        if header.get("include_strings", True):
+            tree.strings = EncodedStrings(text, columns["string_offsets"])
+            tree.text = tree.strings.text
+            tree.multiplicities = columns["multiplicities"]
+            duplicate_offsets, duplicate_ids = columns["duplicate_offsets"], columns["duplicate_ids"]
+            tree.duplicate_ids = {string_id: list(duplicate_ids[duplicate_offsets[i]:duplicate_offsets[i + 1]])
+                                  for i, string_id in enumerate(columns["duplicate_first_ids"])}
+        elif strings is None or multiplicities is None:
+            raise ValueError(f"{path} was saved without its strings, they have to be passed to load")
+        else:
+            tree.strings, tree.text, tree.multiplicities = strings, strings.text, multiplicities
+        terminal_edge_ids = CompactTerminalEdgeIds(columns["terminal_node_ids"], columns["terminal_offsets"],
+                                                   columns["terminal_string_ids"])
+        if mmap:
+            tree.terminal_edge_ids = terminal_edge_ids
+        else:
+            tree.terminal_edge_ids = dict(terminal_edge_ids.items())
+            if tree.collapse_duplicates:
+                for string_id in range(len(tree.strings)):
+                    if tree.multiplicities[string_id] > 0:
+                        tree._first_occurrence(string_id)
+        return tree
@@ -0,0 +1,228 @@
+import heapq
+import json
+import mmap
+import os
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from operator import itemgetter
+import numpy as np
+from CompactSuffixTree import CompactSuffixTree
+from SuffixTree import EncodedStrings, SuffixTree, TERMINATION_SYMBOL
+
+# peak memory of a naively built tree per inserted suffix of 50 bp reads (measured 800-1200 bytes), including its
+# conversion to a CompactSuffixTree before saving
+ESTIMATED_BYTES_PER_SUFFIX = 1200
+MAX_KEY_LENGTH = 8  # longest leading k-mer the suffixes are bucketed by
+SPILL_BUFFER_SIZE = 1 << 16  # suffix positions buffered per group before they are written to its spill file
+INDEX_FILE = "index.json"
+READS_FILE = "reads.bin"  # the reads each followed by the termination symbol, the text of all group trees
+OFFSETS_FILE = "offsets.npy"  # start of every read in READS_FILE, plus its end
+LAST_SYMBOL = "\x7f"  # sorts after every symbol of the reads
+
+
+class ExternalSuffixTree:
+    __slots__ = ("directory", "key_length", "keys", "group_starts", "read_count", "strings", "multiplicities")
+
+    def __init__(self, directory):
+        """
+        Suffix tree of reads kept on disk as one saved CompactSuffixTree per group of buckets, where a bucket holds all
+        suffixes starting with the same key_length symbols. Suffixes shorter than key_length are copied into every
+        group holding suffixes starting with them, so every group tree answers queries about its keys on its own.
+        The group trees share the reads as their strings, so string ids are read ids and the reads are stored once.
+        Queries load one group tree at a time (memory mapped), so the memory needed is bounded by the largest group.
+        Use build to create the directory, this opens an existing one.
+        Args:
+            directory: directory written by build
+        """
+        with open(os.path.join(directory, INDEX_FILE)) as file:
+            index = json.load(file)
+        self.directory = directory
+        self.key_length = index["key_length"]
+        self.keys = index["keys"]  # sorted leading key_length symbols of all suffixes at least that long
+        self.group_starts = index["group_starts"]  # first key of every group, the first one is ""
+        self.read_count = index["read_count"]
+        with open(os.path.join(directory, READS_FILE), "rb") as file:
+            # the map stays open as long as the strings exist
+            text = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if index["text_length"] > 0 else bytearray()
+        self.strings = EncodedStrings(text, np.load(os.path.join(directory, OFFSETS_FILE), mmap_mode="r"))
+        self.multiplicities = array("i", [1]) * self.read_count
+
+    @classmethod
+    def build(cls, reads, directory, memory_limit=1 << 30, verbose=False):
+        """
+        Builds the bucket trees in three passes over the reads: count the suffixes per leading k-mer, spill the text
+        position of every suffix into the file of its group, then build and save the tree of one group after the
+        other. The key length is the shortest one whose largest bucket fits into memory_limit, the buckets are packed
+        into groups of at most memory_limit in key order.
+        Args:
+            reads: iterable of reads, only iterated once
+            directory: directory for the reads, spill files and trees, created if missing
+            memory_limit: peak memory in bytes of building one group tree, estimated with ESTIMATED_BYTES_PER_SUFFIX
+            verbose: print the progress of the passes
+        Returns: ExternalSuffixTree
+        """
+        os.makedirs(directory, exist_ok=True)
+        suffixes_per_group = max(1, memory_limit // ESTIMATED_BYTES_PER_SUFFIX)
+        # pass 1: write the reads and count the suffixes by their first MAX_KEY_LENGTH symbols
+        key_counts = Counter()
+        offsets = array("q", [0])
+        with open(os.path.join(directory, READS_FILE), "wb") as file:
+            for read in reads:
+                file.write((read + TERMINATION_SYMBOL).encode("ascii"))
+                offsets.append(offsets[-1] + len(read) + 1)
+                key_counts.update(read[i:i + MAX_KEY_LENGTH] for i in range(len(read)))
+        np.save(os.path.join(directory, OFFSETS_FILE), np.frombuffer(offsets, dtype=np.int64))
+        read_count, text_length = len(offsets) - 1, offsets[-1]
+        del offsets
+        for key_length in range(1, MAX_KEY_LENGTH + 1):
+            bucket_sizes = Counter()
+            for key, count in key_counts.items():
+                if len(key) >= key_length:
+                    bucket_sizes[key[:key_length]] += count
+            if max(bucket_sizes.values(), default=0) <= suffixes_per_group:
+                break
+        else:
+            raise ValueError(f"memory_limit of {memory_limit} bytes is too small for the largest bucket of "
+                             f"{max(bucket_sizes.values())} suffixes")
+        keys = sorted(bucket_sizes)
+        group_starts = [""]
+        group_size = 0
+        for key in keys:
+            if group_size + bucket_sizes[key] > suffixes_per_group:
+                group_starts.append(key)
+                group_size = 0
+            group_size += bucket_sizes[key]
+        with open(os.path.join(directory, INDEX_FILE), "w") as file:
+            json.dump({"key_length": key_length, "keys": keys, "group_starts": group_starts, "read_count": read_count,
+                       "text_length": text_length}, file)
+        tree = cls(directory)
+        if verbose:
+            print(f"{tree.read_count} reads, {len(keys)} buckets of {key_length}-mers in {len(group_starts)} groups")
+        # pass 2: spill the text position of every suffix into the files of its groups, as 8 byte numbers
+        spill_files = [open(tree._path(group, "spill"), "wb") for group in range(len(group_starts))]
+        spill_buffers = [array("q") for _ in range(len(group_starts))]
+        short_suffix_groups = {}  # {suffix shorter than key_length: range of the groups it is copied into}
+        try:
+            text, offsets = tree.strings.text, tree.strings.offsets
+            for read_id in range(tree.read_count):
+                read_start, read_end = int(offsets[read_id]), int(offsets[read_id + 1]) - 1
+                read = text[read_start:read_end].decode("ascii")
+                for string_pos in range(len(read)):
+                    if len(read) - string_pos >= key_length:
+                        groups = (tree._group(read[string_pos:string_pos + key_length]),)
+                    else:
+                        suffix = read[string_pos:]
+                        groups = short_suffix_groups.get(suffix)
+                        if groups is None:
+                            groups = short_suffix_groups[suffix] = tree._groups_starting_with(suffix)
+                    for group in groups:
+                        spill_buffers[group].append(read_start + string_pos)
+                        if len(spill_buffers[group]) >= SPILL_BUFFER_SIZE:
+                            spill_buffers[group].tofile(spill_files[group])
+                            spill_buffers[group] = array("q")
+            for spill_file, spill_buffer in zip(spill_files, spill_buffers):
+                spill_buffer.tofile(spill_file)
+        finally:
+            for spill_file in spill_files:
+                spill_file.close()
+        # pass 3: build and save the tree of every group, inserting the suffixes of the shared reads by position
+        for group in range(len(group_starts)):
+            positions = np.fromfile(tree._path(group, "spill"), dtype=np.int64)
+            read_ids = np.searchsorted(tree.strings.offsets, positions, side="right") - 1
+            group_tree = SuffixTree(construction_method="naive")
+            group_tree.strings, group_tree.text = tree.strings, tree.strings.text
+            group_tree.multiplicities = tree.multiplicities
+            with memoryview(group_tree.text) as text_view:
+                for read_id, read_start, read_end, position in zip(
+                        read_ids.tolist(), tree.strings.offsets[read_ids].tolist(),
+                        tree.strings.offsets[read_ids + 1].tolist(), positions.tolist()):
+                    group_tree._add_suffix_naive(text_view, read_id, read_start, read_end, position)
+            CompactSuffixTree.from_tree(group_tree).save(tree._path(group, "tree"), include_strings=False)
+            del group_tree
+            os.remove(tree._path(group, "spill"))
+            if verbose:
+                print(f"Group {group + 1}/{len(group_starts)}: {len(positions)} suffixes")
+        return tree
+
+    def find_suffix_matches_for_prefix(self, prefix):
+        """
+        Like SuffixTree.find_suffix_matches_for_prefix, but for a prefix string that is not in the tree: runs
+        SuffixTree.find_suffix_matches_for_prefixes in the only group tree holding suffixes starting with the first
+        key_length symbols of the prefix.
+        Args:
+            prefix: string whose prefix will be tried to be matched
+        Returns: numpy array with the maximally matched length for each read, by read id
+        """
+        match_lengths = np.zeros(self.read_count, dtype=np.int32)
+        if len(prefix) == 0:
+            return match_lengths
+        group_tree = self._load(self._group(prefix[:self.key_length]))
+        _, read_ids, read_match_lengths = group_tree.find_suffix_matches_for_prefixes([prefix])
+        match_lengths[read_ids] = read_match_lengths
+        return match_lengths
+
+    def count_unique_sequences(self, top_k=None):
+        """
+        Like SuffixTree.count_unique_sequences, reads shorter than key_length are only counted in the first group
+        they were copied into.
+        Args:
+            top_k: number of sequences to return, None for all of them
+        Returns: list of the form [(number of sequence occurrences, sequence), ...] ordered by occurrences
+        """
+        def unique_sequences():
+            for group in range(len(self.group_starts)):
+                group_tree = self._load(group)
+                for leaf in group_tree.leaves:
+                    # whole reads are the suffixes starting at position 0
+                    count = sum(1 for string_pos in leaf.string_pos if string_pos == 0)
+                    if count == 0:
+                        continue
+                    sequence = group_tree._path_label(leaf)[:-1]
+                    if len(sequence) >= self.key_length or self._groups_starting_with(sequence)[0] == group:
+                        yield count, sequence
+
+        if top_k is None:
+            return sorted(unique_sequences(), key=itemgetter(0), reverse=True)
+        return heapq.nlargest(top_k, unique_sequences(), key=itemgetter(0))
+
+    def find_most_common_suffixes(self, top_k=1000):
+        """
+        Like SuffixTree.find_most_common_suffixes, traversing one group tree after the other. Every suffix of at least
+        key_length symbols is a leaf of one group only, shorter ones are copied into all groups with suffixes starting
+        with them, where they are a leaf or terminal edge with the same reads on its path, and only counted in the
+        first of these groups.
+        Args:
+            top_k: number of suffixes to return
+        Returns: list of the form [(number of reads ending in a prefix, suffix_length, suffix), ...] ordered by count
+        and then suffix length, the most common suffix
+        """
+        recorded_suffixes = []
+        for group in range(len(self.group_starts)):
+            group_tree = self._load(group)
+            group_leaves = heapq.nlargest(top_k, ((count, suffix_length, leaf)
+                                                  for count, suffix_length, leaf in group_tree._recorded_leaves()
+                                                  if suffix_length >= self.key_length
+                                                  or self._groups_starting_with(group_tree._path_label(leaf)[:-1])[0]
+                                                  == group), key=itemgetter(0, 1))
+            recorded_suffixes.extend((count, suffix_length, group_tree._path_label(leaf)[:-1])
+                                     for count, suffix_length, leaf in group_leaves)
+        recorded_suffixes = heapq.nlargest(top_k, recorded_suffixes, key=itemgetter(0, 1))
+        if len(recorded_suffixes) == 0:
+            return recorded_suffixes, ""
+        return recorded_suffixes, recorded_suffixes[0][2]
+
+    def _group(self, key):
+        """group holding the suffixes starting with key"""
+        return max(0, bisect_right(self.group_starts, key) - 1)
+
+    def _groups_starting_with(self, prefix):
+        """range of the groups holding suffixes starting with prefix"""
+        return range(self._group(prefix), self._group(prefix + LAST_SYMBOL) + 1)
+
+    def _path(self, group, name):
+        return os.path.join(self.directory, f"group{group}.{name}")
+
+    def _load(self, group):
+        return CompactSuffixTree.load(self._path(group, "tree"), strings=self.strings,
+                                      multiplicities=self.multiplicities)
@@ -0,0 +1,396 @@
+import heapq
+from math import floor
+from operator import itemgetter
+import numpy as np
+from SuffixTree import EncodedStrings, TERMINATION_CODE
+
+MISMATCH_CANDIDATES_PER_CHUNK = 1 << 20  # suffixes compared at once by find_suffix_matches_for_prefix_with_mismatches
+
+
+class SuffixArrayLeaf:
+    __slots__ = ("string_id", "string_pos", "path_label_length")
+
+    def __init__(self, string_id, string_pos, path_label_length):
+        """
+        Stands in for the leaf Node of a SuffixTree in the results of SuffixArrayIndex.find_most_common_suffixes
+        Args:
+            string_id: list of string ids having this suffix
+            string_pos: to string_id corresponding list of suffix start positions
+            path_label_length: length of the suffix including termination symbol
+        """
+        self.string_id = string_id
+        self.string_pos = string_pos
+        self.path_label_length = path_label_length
+
+
+def build_suffix_array(ranks):
+    """
+    Prefix doubling: sorts the suffixes by their first 2^k symbols until all ranks are unique.
+    Args:
+        ranks: numpy array of initial ranks (symbols) of all text positions
+    Returns: suffix array and its inverse, the rank of every text position
+    """
+    n = len(ranks)
+    if n == 0:
+        return np.empty(0, dtype=ranks.dtype), ranks
+    k = 1
+    while True:
+        second_ranks = np.full(n, -1, dtype=ranks.dtype)
+        second_ranks[:n - k] = ranks[k:]
+        # sort by (rank, second rank) packed into one 64 bit key
+        keys = ranks.astype(np.int64) * (int(ranks.max()) + 2) + (second_ranks.astype(np.int64) + 1)
+        suffix_array = np.argsort(keys).astype(ranks.dtype)
+        del keys
+        sorted_ranks, sorted_second_ranks = ranks[suffix_array], second_ranks[suffix_array]
+        new_group = np.empty(n, dtype=bool)
+        new_group[0] = True
+        new_group[1:] = (sorted_ranks[1:] != sorted_ranks[:-1]) | (sorted_second_ranks[1:] != sorted_second_ranks[:-1])
+        ranks = np.empty(n, dtype=ranks.dtype)
+        ranks[suffix_array] = np.cumsum(new_group) - 1
+        if new_group.all():
+            return suffix_array, ranks
+        k *= 2
+
+
+def build_lcp_array(text, suffix_array, ranks, starts, lengths):
+    """
+    Kasai's algorithm, run for all strings at once: step j handles position j of every string, starting from the
+    previous step's lcp minus one like the sequential algorithm does for consecutive text positions.
+    Returns: lcp array, lcp[r] is the longest common prefix (without termination symbol) of suffix_array[r - 1] and
+    suffix_array[r], lcp[0] is 0
+    """
+    lcp = np.zeros(len(suffix_array), dtype=np.int32)
+    heights = np.zeros(len(starts), dtype=np.int64)
+    for j in range(int(lengths.max(initial=0))):
+        string_ids = np.nonzero(lengths > j)[0]
+        positions = starts[string_ids] + j
+        position_ranks = ranks[positions]
+        string_heights = np.maximum(heights[string_ids] - 1, 0)
+        has_previous = position_ranks > 0
+        string_heights[~has_previous] = 0
+        previous_positions = suffix_array[np.maximum(position_ranks - 1, 0)].astype(np.int64)
+        # extend the common prefix one symbol at a time for the strings that still match
+        extending = np.nonzero(has_previous)[0]
+        while len(extending) > 0:
+            symbols = text[positions[extending] + string_heights[extending]]
+            previous_symbols = text[previous_positions[extending] + string_heights[extending]]
+            extending = extending[(symbols == previous_symbols) & (symbols != TERMINATION_CODE)]
+            string_heights[extending] += 1
+        lcp[position_ranks[has_previous]] = string_heights[has_previous]
+        heights[string_ids] = string_heights
+    return lcp
+
+
+class LongestCommonExtension:
+    __slots__ = ("ranks", "lcp", "block_size", "prefix_minima", "suffix_minima", "block_minima")
+
+    def __init__(self, suffix_array, lcp, block_size=32):
+        """
+        Longest common extension (longest common prefix of the suffixes at two text positions) as range minimum query
+        over the lcp array between the ranks of both suffixes. The lcp array is split into blocks: a query over
+        several blocks is the minimum of the suffix minimum in its first block, the prefix minimum in its last block
+        and a sparse table lookup over the blocks in between, a query within one block scans it.
+        Args:
+            suffix_array: suffix array of the text
+            lcp: lcp array as built by build_lcp_array, never extends over a termination symbol
+            block_size: number of lcp entries per block
+        """
+        self.ranks = np.empty(len(suffix_array), dtype=suffix_array.dtype)
+        self.ranks[suffix_array] = np.arange(len(suffix_array), dtype=suffix_array.dtype)
+        max_lcp = int(lcp.max(initial=0))
+        lcp_dtype = np.uint8 if max_lcp < 2 ** 8 else np.uint16 if max_lcp < 2 ** 16 else np.int32
+        self.block_size = block_size
+        padded = np.full(-(-len(lcp) // block_size) * block_size, np.iinfo(lcp_dtype).max, dtype=lcp_dtype)
+        padded[:len(lcp)] = lcp
+        self.lcp = padded
+        blocks = padded.reshape(-1, block_size)
+        self.prefix_minima = np.minimum.accumulate(blocks, axis=1).ravel()
+        self.suffix_minima = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+        # block_minima[k, i] is the minimum of the blocks i..i + 2^k - 1, padded where they don't all exist
+        self.block_minima = np.full((max(1, len(blocks)).bit_length(), len(blocks)), np.iinfo(lcp_dtype).max,
+                                    dtype=lcp_dtype)
+        self.block_minima[0] = blocks.min(axis=1)
+        for level in range(1, len(self.block_minima)):
+            width, count = 2 ** (level - 1), len(blocks) - 2 ** level + 1
+            self.block_minima[level, :count] = np.minimum(self.block_minima[level - 1, :count],
+                                                          self.block_minima[level - 1, width:width + count])
+
+    def range_minimum(self, low, high):
+        """minimum of lcp[low:high + 1] for numpy arrays of positions with low <= high"""
+        block_size = self.block_size
+        low_blocks, high_blocks = low // block_size, high // block_size
+        minima = np.minimum(self.suffix_minima[low], self.prefix_minima[high])
+        # blocks strictly between the first and the last one, one lookup of two overlapping power of two ranges
+        between_counts = high_blocks - low_blocks - 1
+        between = between_counts > 0
+        first = np.where(between, low_blocks + 1, 0)
+        levels = np.log2(np.maximum(between_counts, 1)).astype(np.int64)
+        last = first + np.where(between, between_counts, 1) - (1 << levels)
+        between_minima = np.minimum(self.block_minima[levels, first], self.block_minima[levels, last])
+        minima = np.where(between, np.minimum(minima, between_minima), minima)
+        # queries within one block
+        within = np.nonzero(low_blocks == high_blocks)[0]
+        if len(within) > 0:
+            positions = low[within, None] + np.arange(block_size)
+            values = self.lcp[np.minimum(positions, len(self.lcp) - 1)]
+            values[positions > high[within, None]] = np.iinfo(self.lcp.dtype).max
+            minima[within] = values.min(axis=1)
+        return minima
+
+    def query(self, positions, other_positions):
+        """longest common extensions of the suffixes at the text positions in both numpy arrays, which must differ"""
+        ranks, other_ranks = self.ranks[positions], self.ranks[other_positions]
+        return self.range_minimum(np.minimum(ranks, other_ranks) + 1, np.maximum(ranks, other_ranks)).astype(np.int64)
+
+    def nbytes(self):
+        return (self.ranks.nbytes + self.lcp.nbytes + self.prefix_minima.nbytes + self.suffix_minima.nbytes
+                + self.block_minima.nbytes)
+
+
+class SuffixArrayIndex:
+    """
+    Generalized suffix array with lcp array over all strings, answering the queries the task scripts run on a
+    SuffixTree (find_suffix_matches_for_prefix, find_most_common_suffixes, count_unique_sequences) with a few bytes
+    per suffix. Every termination symbol is ranked as a distinct symbol smaller than all others, so equal suffixes of
+    different strings are adjacent and their common prefix never extends over the termination symbol.
+    Strings can be added any time, the arrays are (re)built on the next query.
+    """
+    __slots__ = ("strings", "text", "suffix_array", "lcp", "starts", "lengths", "indexed_strings", "lce")
+
+    def __init__(self, strings=None, verbose=False):
+        """
+        Args:
+            strings: string or list of strings to be added to the index
+            verbose: if true print construction progress
+        """
+        self.strings = EncodedStrings()
+        if strings is not None:
+            if not isinstance(strings, list):
+                strings = [strings]
+            for string in strings:
+                self.strings.append(string)
+        self.text = None
+        self.suffix_array = None
+        self.lcp = None
+        self.starts = None
+        self.lengths = None
+        self.indexed_strings = 0
+        self.lce = None  # LongestCommonExtension, built by the first query needing it
+
+        self._construct(verbose)
+
+    def add_string(self, string, verbose=False):
+        """adds single string to the index and returns it's string_id"""
+        return self.strings.append(string)
+
+    def _construct(self, verbose=False):
+        # an empty index is built by the first query after strings were added
+        if len(self.strings) == 0 or self.indexed_strings == len(self.strings) and self.suffix_array is not None:
+            return
+        # copy, a view would prevent the byte text from growing when strings are added
+        self.text = np.frombuffer(bytes(self.strings.text), dtype=np.uint8)
+        offsets = np.array(self.strings.offsets, dtype=np.int64)
+        self.starts = offsets[:-1]
+        self.lengths = np.diff(offsets)
+        index_dtype = np.int32 if len(self.text) + len(self.starts) + 256 < 2 ** 31 else np.int64
+        # termination symbols get the ranks 0..number of strings - 1, all other symbols follow
+        ranks = self.text.astype(index_dtype) + len(self.starts)
+        terminal_positions = offsets[1:] - 1
+        ranks[terminal_positions] = np.arange(len(self.starts), dtype=index_dtype)
+        self.suffix_array, ranks = build_suffix_array(ranks)
+        if verbose:
+            print(f"Suffix array of {len(self.suffix_array)} suffixes built")
+        self.lcp = build_lcp_array(self.text, self.suffix_array, ranks, self.starts, self.lengths)
+        if verbose:
+            print("LCP array built")
+        self.indexed_strings = len(self.strings)
+        self.lce = None
+
+    def _string_ids_of(self, positions):
+        return np.searchsorted(self.starts, positions, side="right") - 1
+
+    def _suffix_lengths(self, positions, string_ids):
+        """lengths of the suffixes at positions without the termination symbol"""
+        return self.starts[string_ids] + self.lengths[string_ids] - 1 - positions
+
+    def find_suffix_matches_for_prefix(self, prefix_string_id):
+        """
+        Finds the length of the longest suffix-prefix match between the given prefix string and all other suffixes
+        in the index.
+        Args:
+            prefix_string_id: string_id of the string whose prefix will be tried to be matched
+        Returns: dict of maximally matched length for each string in the index
+        """
+        self._construct()
+        text, suffix_array = self.text, self.suffix_array
+        prefix = text[self.strings.start(prefix_string_id):self.strings.end(prefix_string_id) - 1]
+        match_lengths = np.zeros(len(self.strings), dtype=np.int64)
+        # suffix_array[low:high] are the suffixes starting with prefix[:length]
+        low, high = 0, len(suffix_array)
+        for length in range(1, len(prefix) + 1):
+            symbols = text[suffix_array[low:high].astype(np.int64) + length - 1]
+            low, high = (low + np.searchsorted(symbols, prefix[length - 1], side="left"),
+                         low + np.searchsorted(symbols, prefix[length - 1], side="right"))
+            if low == high:
+                break
+            # suffixes equal to prefix[:length] come first since the termination symbols are ranked lowest
+            next_symbols = text[suffix_array[low:high].astype(np.int64) + length]
+            terminal_count = np.searchsorted(next_symbols, TERMINATION_CODE, side="right")
+            match_lengths[self._string_ids_of(suffix_array[low:low + terminal_count])] = length
+        strings_match_lengths = dict(enumerate(match_lengths.tolist()))
+        # remove prefix itself
+        strings_match_lengths.pop(prefix_string_id, None)
+        return strings_match_lengths
+
+    def find_suffix_matches_for_prefix_with_mismatches(self, prefix_string_id, max_mismatch_rate):
+        """
+        Same result as SuffixTree.find_suffix_matches_for_prefix_with_mismatches. The candidates are the suffixes of
+        every string that are shorter than the prefix string, each one compared with the prefix by jumping from
+        mismatch to mismatch with longest common extension queries (kangaroo method). All candidates jump at once, so
+        a comparison costs one query per allowed mismatch instead of one step per symbol and the number of numpy
+        operations only depends on the allowed mismatches. The candidates are processed in chunks of
+        MISMATCH_CANDIDATES_PER_CHUNK suffixes.
+        Args:
+            prefix_string_id: string_id of the string whose prefix will be tried to be matched
+            max_mismatch_rate: number in 0..1 specifying the maximally allowed mismatch percentage
+        Returns: dict of maximally matched length for each string in the index
+        """
+        self._construct()
+        if self.lce is None:
+            self.lce = LongestCommonExtension(self.suffix_array, self.lcp)
+        prefix_start, prefix_length = self.strings.start(prefix_string_id), self.strings.length(prefix_string_id)
+        # maximally possible mismatch count no matter the length of the match
+        max_mismatch_count = floor(prefix_length * max_mismatch_rate)
+        # allowed mismatches of a match by its length
+        allowed_mismatches = np.array([0] + [max(mismatch_count for mismatch_count in range(max_mismatch_count + 1)
+                                                 if mismatch_count / match_length <= max_mismatch_rate)
+                                             for match_length in range(1, prefix_length)], dtype=np.int64)
+        string_lengths = self.lengths - 1  # without termination symbol
+        candidate_counts = np.minimum(string_lengths, prefix_length - 1)
+        candidate_counts[prefix_string_id] = 0
+        candidate_ends = np.cumsum(candidate_counts)
+        match_lengths = np.zeros(len(self.strings), dtype=np.int64)
+        first_id = 0
+        while first_id < len(self.strings):
+            # strings first_id..last_id - 1 have at most MISMATCH_CANDIDATES_PER_CHUNK candidates, or only one string
+            chunk_start = candidate_ends[first_id] - candidate_counts[first_id]
+            last_id = max(first_id + 1, int(np.searchsorted(candidate_ends, chunk_start + MISMATCH_CANDIDATES_PER_CHUNK,
+                                                            side="right")))
+            counts = candidate_counts[first_id:last_id]
+            string_ids = np.repeat(np.arange(first_id, last_id), counts)
+            # suffix lengths 1..count of every string
+            lengths = np.arange(len(string_ids), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+            matched = self._kangaroo_matches(self.starts[string_ids] + string_lengths[string_ids] - lengths,
+                                             prefix_start, lengths, allowed_mismatches[lengths])
+            np.maximum.at(match_lengths, string_ids[matched], lengths[matched])
+            first_id = last_id
+        strings_match_lengths = dict(enumerate(match_lengths.tolist()))
+        # remove prefix itself
+        strings_match_lengths.pop(prefix_string_id, None)
+        return strings_match_lengths
+
+    def _kangaroo_matches(self, positions, prefix_start, lengths, allowed_mismatches):
+        """
+        Compares text[positions[i]:positions[i] + lengths[i]] with the prefix at prefix_start with at most
+        allowed_mismatches[i] mismatches for all i at once, returns a boolean numpy array of the matching ones
+        """
+        positions = positions.copy()
+        prefix_positions = np.full(len(positions), prefix_start, dtype=np.int64)
+        remaining = lengths.copy()
+        matched = np.zeros(len(positions), dtype=bool)
+        # the candidates still comparing with at most allowed_mismatches so far
+        candidates = np.arange(len(positions))
+        mismatch_count = 0
+        while len(candidates) > 0:
+            extensions = self.lce.query(positions[candidates], prefix_positions[candidates])
+            done = extensions >= remaining[candidates]
+            matched[candidates[done]] = True
+            candidates, extensions = candidates[~done], extensions[~done]
+            # skip the common extension and the mismatch after it
+            positions[candidates] += extensions + 1
+            prefix_positions[candidates] += extensions + 1
+            remaining[candidates] -= extensions + 1
+            mismatch_count += 1
+            within = allowed_mismatches[candidates] >= mismatch_count
+            matched[candidates[within & (remaining[candidates] == 0)]] = True
+            candidates = candidates[within & (remaining[candidates] > 0)]
+        return matched
+
+    def find_most_common_suffixes(self, top_k=1000):
+        """
+        Finds the suffixes with the most strings ending in a (non-empty) prefix of them, the same count
+        SuffixTree.find_most_common_suffixes computes from the terminal edges on the path to every leaf.
+        Sweeps the suffix array keeping a stack of the suffixes that are a prefix of the current one.
+        Args:
+            top_k: number of suffixes to return, the full list would have one entry per distinct suffix
+        Returns: list of the form [(number_of_strings, suffix_length, SuffixArrayLeaf), ...] ordered by most strings
+        and then suffix length, the most common suffix
+        """
+        self._construct()
+        suffix_array = self.suffix_array.astype(np.int64)
+        string_ids = self._string_ids_of(suffix_array)
+        suffix_lengths = self._suffix_lengths(suffix_array, string_ids).tolist()
+        lcp = self.lcp.tolist()
+        string_ids = string_ids.tolist()
+        # strings whose suffix is on the stack and how often
+        string_multiplicities = [0] * len(self.strings)
+        distinct_strings = 0
+        stack = []  # [(suffix_length, string_id), ...]
+        # [(number_of_strings, suffix_length, first rank, last rank + 1), ...]
+        records = []
+        run_start = 0
+        for rank in range(len(suffix_array)):
+            suffix_length = suffix_lengths[rank]
+            # pop suffixes that are no prefix of the current one anymore
+            while stack and stack[-1][0] > lcp[rank]:
+                _, string_id = stack.pop()
+                string_multiplicities[string_id] -= 1
+                if string_multiplicities[string_id] == 0:
+                    distinct_strings -= 1
+            if suffix_length == 0:
+                run_start = rank + 1
+                continue  # skip suffixes only consisting of the termination symbol
+            string_id = string_ids[rank]
+            stack.append((suffix_length, string_id))
+            string_multiplicities[string_id] += 1
+            if string_multiplicities[string_id] == 1:
+                distinct_strings += 1
+            # record after the last of a run of equal suffixes
+            if rank + 1 == len(suffix_array) or lcp[rank + 1] != suffix_length or suffix_lengths[rank + 1] != suffix_length:
+                records.append((distinct_strings, suffix_length, run_start, rank + 1))
+                run_start = rank + 1
+        recorded_leaves = []
+        for count, suffix_length, first_rank, last_rank in heapq.nlargest(top_k, records, key=itemgetter(0, 1)):
+            leaf = SuffixArrayLeaf(string_ids[first_rank:last_rank],
+                                   [int(suffix_array[rank] - self.starts[string_ids[rank]])
+                                    for rank in range(first_rank, last_rank)],
+                                   suffix_length + 1)
+            recorded_leaves.append((count, suffix_length, leaf))
+        if len(recorded_leaves) == 0:
+            return recorded_leaves, ""
+        best_leaf = recorded_leaves[0][2]
+        most_common_suffix = self.strings[best_leaf.string_id[0]][-best_leaf.path_label_length:-1]
+        return recorded_leaves, most_common_suffix
+
+    def count_unique_sequences(self):
+        """Counts the amount of unique sequences in the index."""
+        self._construct()
+        suffix_array = self.suffix_array.astype(np.int64)
+        string_ids = self._string_ids_of(suffix_array)
+        suffix_lengths = self._suffix_lengths(suffix_array, string_ids)
+        is_whole_string = suffix_array == self.starts[string_ids]
+        # runs of equal suffixes: same length and fully shared with the previous one
+        run_starts = np.ones(len(suffix_array), dtype=bool)
+        run_starts[1:] = (self.lcp[1:] != suffix_lengths[1:]) | (suffix_lengths[1:] != suffix_lengths[:-1])
+        run_starts = np.nonzero(run_starts)[0]
+        counts = np.add.reduceat(is_whole_string.astype(np.int64), run_starts)
+        # [(number of sequence occurrences, sequence), ...]
+        unique_sequences = [(int(count), self.strings[int(string_ids[rank])][-int(suffix_lengths[rank]) - 1:-1])
+                            for count, rank in zip(counts, run_starts) if count > 0]
+        unique_sequences.sort(key=itemgetter(0), reverse=True)
+        return unique_sequences
+
+    def memory_usage(self):
+        """bytes used by text, suffix array and lcp array (and the longest common extension structure if built)"""
+        return (sum(column.nbytes for column in (self.text, self.suffix_array, self.lcp, self.starts, self.lengths))
+                + (self.lce.nbytes() if self.lce is not None else 0))
@@ -1,45 +1,65 @@
+import heapq
 import json
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import accumulate, product
 from math import floor
 from operator import itemgetter
+import numpy as np
 
 
 class Node:
-    __slots__ = ("start", "end", "string_id", "string_pos", "children", "terminal_edge_ids", "parent", "path_label_length")
+    __slots__ = ("start", "end", "string_id", "string_pos", "children", "terminal_edge_ids", "parent",
+                 "path_label_length", "suffix_link", "leaf_count", "string_count")
 
-    def __init__(self, start=None, end=None, string_id=None, string_pos=None, children=None):
+    def __init__(self, start=None, end=None, string_id=None, string_pos=None):
         """
         Args:
-            start: start position in string string_id, representing string written to the edge going towards this node
-            end: end position in string string_id, representing string written to the edge going towards this node
-            string_id: string id (list pos) to whom start and end correspond to
-            string_pos: only in leaf nodes, to string_id corresponding list representing the suffix starting at this position
-            children: Node or list of Nodes being children of this Node
+            start: start position in the text of the tree, representing string written to the edge going towards this
+            node
+            end: end position in the text of the tree, representing string written to the edge going towards this
+            node
+            string_id: only in leaf nodes, string id (list pos) of the string the suffix belongs to
+            string_pos: only in leaf nodes, to string_id corresponding list representing the suffix starting at this
+            position
         """
         self.start = start
         self.end = end
         self.string_id = [string_id] if string_id is not None else None
         self.string_pos = [string_pos] if string_pos is not None else None
-        self.children = []
-        if children is not None:
-            self.add_children(children)
+        self.children = {}  # {first symbol code of edge label: Node}
         self.terminal_edge_ids = None
 
         self.parent = None
         self.path_label_length = 0
+        self.suffix_link = None  # only set on internal nodes built by Ukkonen
+        # set by SuffixTree.annotate: number of suffixes in the leaves below and of distinct strings they belong to
+        self.leaf_count = None
+        self.string_count = None
 
     def __repr__(self):
-        return f"{self.string_id[0]}[{self.start}:{self.end}]"
+        return f"[{self.start}:{self.end}]"
 
-    def add_children(self, children: "Node"):  # type annotation just for PyCharm...
-        """add child(ren) and return the last one"""
-        if not isinstance(children, list):
-            children = [children]
-        self.children.extend(children)
+    def add_child(self, symbol, child: "Node"):  # type annotation just for PyCharm...
+        """add child whose edge label starts with symbol, replacing the current one for symbol, and return it"""
+        self.children[symbol] = child
+        child.parent = self
+        child.update_path_label_length()
+        return child
 
-        for child in children:
-            child.parent = self
-            child.update_path_label_length()
-        return self.children[-1]
+    def get_child(self, symbol):
+        """returns child whose edge label starts with symbol or None"""
+        return self.children.get(symbol)
+
+    def has_children(self):
+        return len(self.children) > 0
+
+    def iter_children(self):
+        """iterator of (first symbol code of edge label, child) in the order the children were added"""
+        return iter(self.children.items())
 
     def add_string_to_leaf(self, string_id, string_pos):
         self.string_id.append(string_id)
@@ -64,124 +84,601 @@ class Node:
 
 
 TERMINATION_SYMBOL = "$"
+TERMINATION_CODE = ord(TERMINATION_SYMBOL)
+BUCKETS_PER_WORKER = 8  # parallel construction splits the suffixes into at least this many buckets per worker
+
+
+class EncodedStrings:
+    __slots__ = ("text", "offsets")
+
+    def __init__(self, text=None, offsets=None):
+        """
+        Read-only list of strings stored as one contiguous byte text, every string followed by the termination symbol.
+        Indexing decodes the string (including the termination symbol) only on access.
+        Args:
+            text: existing text to take over together with its offsets
+            offsets: start of every string in text, plus end of text
+        """
+        self.text = text if text is not None else bytearray()
+        # start of every string in text, plus end of text
+        self.offsets = offsets if offsets is not None else array("q", [0])
+
+    def append(self, string):
+        """adds string and returns it's string_id"""
+        self.text += string.encode("ascii")
+        self.text.append(TERMINATION_CODE)
+        self.offsets.append(len(self.text))
+        return len(self.offsets) - 2
+
+    def start(self, string_id):
+        return self.offsets[string_id]
+
+    def end(self, string_id):
+        return self.offsets[string_id + 1]
+
+    def length(self, string_id):
+        """length of the string including termination symbol"""
+        return self.offsets[string_id + 1] - self.offsets[string_id]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, string_id):
+        if string_id < 0:
+            string_id += len(self)
+        if not 0 <= string_id < len(self):
+            raise IndexError("string index out of range")
+        return self.text[self.offsets[string_id]:self.offsets[string_id + 1]].decode("ascii")
+
+    def __iter__(self):
+        return (self[string_id] for string_id in range(len(self)))
+
+
+def _count_mismatches(prefix, prefix_pos, text, text_pos, length):
+    """
+    number of positions in which prefix[prefix_pos:prefix_pos + length] and text[text_pos:text_pos + length]
+    differ
+    """
+    if length == 1:
+        return int(prefix[prefix_pos] != text[text_pos])
+    # equal symbols give zero bytes in the xor of both strings
+    difference = (int.from_bytes(prefix[prefix_pos:prefix_pos + length], "little")
+                  ^ int.from_bytes(text[text_pos:text_pos + length], "little"))
+    return length - difference.to_bytes(length, "little").count(0)
+
+
+@lru_cache(maxsize=None)
+def _delta_byte_summaries():
+    """
+    (sum, minimal prefix sum) of the +1/-1 deltas encoded by every valid pair of plus/minus bytes, by plus << 8 | minus.
+    Built on the first edit distance query and cached.
+    """
+    summaries = {}
+    for deltas in product((0, 1, -1), repeat=8):
+        plus = sum(1 << bit for bit, delta in enumerate(deltas) if delta == 1)
+        minus = sum(1 << bit for bit, delta in enumerate(deltas) if delta == -1)
+        prefix_sums = list(accumulate(deltas))
+        summaries[plus << 8 | minus] = (prefix_sums[-1], min(0, min(prefix_sums)))
+    return summaries
+
+
+def _column_edit_distance(plus, minus, column, prefix_length, max_error_count):
+    """
+    minimal edit distance of the first `column` symbols of a string to any prefix of a string of prefix_length, given
+    the bit vectors of the positive and negative vertical deltas of their DP column, bit j being the difference between
+    the rows j + 1 and j. Only the rows within max_error_count of the diagonal are looked at, the others are further
+    away anyway, so any value above max_error_count just means too many errors.
+    """
+    start = column - max_error_count
+    if start > prefix_length:
+        return max_error_count + 1
+    delta_byte_summaries = _delta_byte_summaries()
+    start = max(0, start)
+    start_mask = (1 << start) - 1
+    running = minimum = column + bin(plus & start_mask).count("1") - bin(minus & start_mask).count("1")
+    window_mask = (1 << (min(prefix_length, column + max_error_count) - start)) - 1
+    plus = (plus >> start) & window_mask
+    minus = (minus >> start) & window_mask
+    while plus or minus:
+        total, byte_minimum = delta_byte_summaries[(plus & 255) << 8 | (minus & 255)]
+        if running + byte_minimum < minimum:
+            minimum = running + byte_minimum
+        running += total
+        plus >>= 8
+        minus >>= 8
+    return minimum
 
 
 class SuffixTree:
-    __slots__ = ("strings", "root", "_add_string", "track_terminal_edges", "leaves")
+    __slots__ = ("strings", "text", "root", "_add_string", "track_terminal_edges", "max_depth", "leaves",
+                 "collapse_duplicates", "sequence_ids", "multiplicities", "duplicate_ids", "workers",
+                 "construction_method", "annotated")
 
-    def __init__(self, strings=None, construction_method="naive", track_terminal_edges=False, verbose=False):
+    def __init__(self, strings=None, construction_method="naive", track_terminal_edges=False, max_depth=None,
+                 collapse_duplicates=False, workers=1, verbose=False):
         """
         Args:
             strings: string or list of strings to be added to the suffix tree
             construction_method: select construction method between "ukkonen" and "naive"
             track_terminal_edges: keep track of terminal edges for every internal node
+            max_depth: only insert suffixes of at most this length (without termination symbol), enough for
+                suffix-prefix matches of prefix strings up to this length, strings at most this long are fully inserted
+            collapse_duplicates: only insert the first of equal strings, the copies are counted in multiplicities and
+                get the results of their first occurrence in all queries
+            workers: number of processes building the tree, with more than one the suffixes are split into buckets by
+                their first symbols, inserted like the naive construction_method per bucket and the bucket trees are
+                stitched together, giving the same tree as the naive construction. Only works with the naive
+                construction_method, as the bucket trees have no suffix links.
             verbose: if true print Suffix Tree on every construction iteration
         """
-        if strings is None:
-            self.strings = []
-        else:
+        if workers > 1 and construction_method != "naive":
+            raise ValueError(f"construction_method {construction_method!r} can't be used with {workers} workers, "
+                             f"parallel construction needs the naive construction_method")
+        self.strings = EncodedStrings()
+        self.text = self.strings.text  # edge labels of all nodes are positions in this text
+        if strings is not None:
             if not isinstance(strings, list):
                 strings = [strings]
-            self.strings = [s + TERMINATION_SYMBOL for s in strings]
-        self.root = Node()
-        self._add_string = self._add_string_naive if construction_method == "naive" else self._add_string_ukkonen
+            for string in strings:
+                self.strings.append(string)
+        self.construction_method = construction_method
+        self._add_string = self._add_string_naive if self.construction_method == "naive" else self._add_string_ukkonen
         self.track_terminal_edges = track_terminal_edges
-        self.leaves = []  # list of leaves in tree
+        self.max_depth = max_depth
+        self.collapse_duplicates = collapse_duplicates
+        # {hash of the string: string_id of its first occurrence}, only filled when collapsing duplicates
+        self.sequence_ids = {}
+        self.multiplicities = array("i")  # number of copies of each inserted string, 0 for collapsed duplicates
+        self.duplicate_ids = {}  # {string_id: [string_ids of its collapsed duplicates], ...}
+        self.workers = workers
+        self.annotated = False  # leaf_count and string_count of the nodes are up to date
+        self._init_nodes()
 
         self._construct(verbose)
 
+    def _init_nodes(self):
+        """set up root and leaf list, overwritten by tree representations not using Node objects"""
+        self.root = Node()
+        self.leaves = []  # list of leaves in tree
+
+    def _create_node(self, start=None, end=None, string_id=None, string_pos=None):
+        return Node(start, end, string_id, string_pos)
+
     def add_string(self, string, verbose=False):
         """adds single string to SuffixTree and returns it's string_id"""
-        string = string + TERMINATION_SYMBOL
-        self.strings.append(string)
-        string_id = len(self.strings) - 1
-        self._add_string(string, string_id, verbose)
+        string_id = self.strings.append(string)
+        self._insert_string(string_id, verbose)
+        self.annotated = False
         return string_id
 
     def _construct(self, verbose=False):
-        for string_id, string in enumerate(self.strings):
-            self._add_string(string, string_id, verbose)
-
-    def _add_string_naive(self, string, string_id, verbose=False):
-        for i in range(len(string)):  # add suffix i..m
-            suffix = string[i:]
-            current_node = self.root
-            suffix_pos = 0
-            node_found = False
-            # find node to add leaf node on
-            while not node_found:
-                # find child node with matching label
-                for child_id, child in enumerate(current_node.children):
-                    child_string = self.strings[child.string_id[0]]
-                    # check first label character of current node
-                    if suffix[suffix_pos] == child_string[child.start]:
-                        # check rest of the label
-                        suffix_pos += 1
-                        for label_pos in range(child.start + 1, child.end):
-                            # splitting point?
-                            if suffix[suffix_pos] != child_string[label_pos]:
-                                # add splitting node
-                                split_node = current_node.add_children(Node(child.start, label_pos, child.string_id[0]))
-                                split_node.add_children(current_node.children.pop(child_id))
-                                child.set_start(label_pos)
-                                if self.track_terminal_edges and child_string[label_pos] == TERMINATION_SYMBOL:
-                                    split_node.add_terminal_edge_ids(child.string_id)
-                                # to add leaf node
-                                current_node = split_node
-                                node_found = True
-                                break
-                            suffix_pos += 1
-                        # matched until next node, repeat process
-                        else:
-                            current_node = child
-                        break
-                # no child matched rest of suffix
+        string_ids = [string_id for string_id in range(len(self.strings)) if self._register_string(string_id)]
+        if self.workers > 1 and len(string_ids) > 0:
+            self._construct_parallel(string_ids, verbose)
+        else:
+            for string_id in string_ids:
+                self._add_string(string_id, verbose)
+
+    def _insert_string(self, string_id, verbose=False):
+        """inserts the suffixes of string_id, or only counts it if it is a duplicate of an already inserted string"""
+        if self._register_string(string_id):
+            self._add_string(string_id, verbose)
+
+    def _register_string(self, string_id):
+        """counts string_id and returns whether its suffixes have to be inserted, i.e. it is no collapsed duplicate"""
+        self.multiplicities.append(1)
+        if self.collapse_duplicates:
+            first_id = self._first_occurrence(string_id)
+            if first_id != string_id:
+                self.multiplicities[first_id] += 1
+                self.multiplicities[string_id] = 0
+                self.duplicate_ids.setdefault(first_id, []).append(string_id)
+                return False
+        return True
+
+    def _first_occurrence(self, string_id):
+        """
+        string_id of the first registered string equal to string_id, registering string_id in sequence_ids if there is
+        none. Strings are keyed by their 64 bit hash instead of a copy of them, a hit is confirmed by comparing the
+        strings in the text and hashes of different strings are resolved by trying the following keys.
+        """
+        strings, text = self.strings, self.text
+        start, end = strings.start(string_id), strings.end(string_id)
+        key = hash(bytes(text[start:end]))
+        while True:
+            first_id = self.sequence_ids.setdefault(key, string_id)
+            if first_id == string_id or text[strings.start(first_id):strings.end(first_id)] == text[start:end]:
+                return first_id
+            key += 1
+
+    def _construct_parallel(self, string_ids, verbose=False):
+        """
+        Suffixes starting with different bucket_length symbols only share the top bucket_length - 1 levels of the tree.
+        Every worker builds the tree of the suffixes in its buckets, which are merged on these top levels afterwards.
+        """
+        text = bytes(self.text)
+        offsets = self.strings.offsets
+        alphabet_size = len(set(text) - {TERMINATION_CODE})
+        bucket_length = 1
+        while 1 < alphabet_size and alphabet_size ** bucket_length < BUCKETS_PER_WORKER * self.workers:
+            bucket_length += 1
+        # bucket of every suffix: its first bucket_length symbols, or the whole suffix with termination symbol
+        bucket_sizes = Counter()
+        for string_id in string_ids:
+            string_start, string_end = offsets[string_id], offsets[string_id + 1]
+            bucket_sizes.update(text[i:min(i + bucket_length, string_end)]
+                                for i in range(self._first_suffix(string_start, string_end), string_end))
+        # distribute buckets, largest first, to the worker with the fewest suffixes so far
+        worker_loads = [(0, worker) for worker in range(self.workers)]
+        worker_buckets = [set() for _ in range(self.workers)]
+        for bucket, size in bucket_sizes.most_common():
+            load, worker = heapq.heappop(worker_loads)
+            worker_buckets[worker].add(bucket)
+            heapq.heappush(worker_loads, (load + size, worker))
+        worker_buckets = [buckets for buckets in worker_buckets if len(buckets) > 0]
+        with ProcessPoolExecutor(max_workers=len(worker_buckets)) as executor:
+            futures = [executor.submit(_build_bucket_tree, text, offsets, string_ids, self.max_depth, bucket_length,
+                                       buckets) for buckets in worker_buckets]
+            bucket_trees = []
+            for future in futures:
+                bucket_trees.append(future.result())
+                if verbose:
+                    print(f"Bucket tree {len(bucket_trees)} of {len(futures)} built")
+        # [(text position of the first suffix of the leaf, leaf), ...]
+        new_leaves = []
+        self._merge_edges(self.root, [(bucket_tree, child, 0) for bucket_tree in bucket_trees
+                                      for child in bucket_tree.children(ROOT_INDEX)], new_leaves)
+        # leaves in the order the naive construction creates them
+        new_leaves.sort(key=itemgetter(0))
+        for _, leaf in new_leaves:
+            self.leaves.append(leaf)
+
+    def _merge_edges(self, node, edges, new_leaves):
+        """
+        Adds the edges of bucket trees below node, merging edges starting with the same symbol. Children are added
+        ordered by their first suffix, which is the order the naive construction adds them in.
+        Args:
+            node: node of this tree the edges hang from
+            edges: [(BucketTree, node index, label offset), ...], the edge labels start label offset symbols later
+            new_leaves: list the created leaves are appended to
+        """
+        text = self.text
+        # {first symbol: [(BucketTree, node index, label offset), ...]}
+        edge_groups = {}
+        for bucket_tree, node_index, offset in edges:
+            symbol = text[bucket_tree.starts[node_index] + offset]
+            edge_groups.setdefault(symbol, []).append((bucket_tree, node_index, offset))
+        for symbol, group in sorted(edge_groups.items(),
+                                    key=lambda item: min(tree.firsts[index] for tree, index, _ in item[1])):
+            if len(group) == 1:
+                self._attach_subtree(node, *group[0], new_leaves)
+                continue
+            # the edges come from different buckets, so they split before the end of any leaf label
+            label_starts = [bucket_tree.starts[node_index] + offset for bucket_tree, node_index, offset in group]
+            label_lengths = [bucket_tree.ends[node_index] - label_start
+                             for (bucket_tree, node_index, _), label_start in zip(group, label_starts)]
+            common_length = 1
+            while (common_length < min(label_lengths)
+                   and all(text[label_start + common_length] == text[label_starts[0] + common_length]
+                           for label_start in label_starts)):
+                common_length += 1
+            split_node = node.add_child(symbol, self._create_node(label_starts[0], label_starts[0] + common_length))
+            next_edges = []
+            for (bucket_tree, node_index, offset), label_length in zip(group, label_lengths):
+                if label_length == common_length:
+                    next_edges.extend((bucket_tree, child, 0) for child in bucket_tree.children(node_index))
+                else:
+                    next_edges.append((bucket_tree, node_index, offset + common_length))
+            self._merge_edges(split_node, next_edges, new_leaves)
+
+    def _attach_subtree(self, parent, bucket_tree, node_index, offset, new_leaves):
+        """copies node_index and its subtree from bucket_tree below parent, skipping offset symbols of its label"""
+        text = self.text
+        created_nodes = {}  # {node index: internal Node}
+        for index in range(node_index, bucket_tree.subtree_ends[node_index]):
+            if index == node_index:
+                start, node_parent = bucket_tree.starts[index] + offset, parent
+            else:
+                start, node_parent = bucket_tree.starts[index], created_nodes[bucket_tree.parents[index]]
+            end = bucket_tree.ends[index]
+            payload_start, payload_end = bucket_tree.payload_offsets[index], bucket_tree.payload_offsets[index + 1]
+            if payload_start == payload_end:
+                created_nodes[index] = node_parent.add_child(text[start], self._create_node(start, end))
+                continue
+            string_ids = bucket_tree.payload_string_ids[payload_start:payload_end]
+            string_pos = bucket_tree.payload_string_pos[payload_start:payload_end]
+            leaf = self._create_node(start, end, string_ids[0], string_pos[0])
+            for payload in range(1, len(string_ids)):
+                leaf.add_string_to_leaf(string_ids[payload], string_pos[payload])
+            node_parent.add_child(text[start], leaf)
+            new_leaves.append((bucket_tree.firsts[index], leaf))
+            if self.track_terminal_edges and end - start == 1:
+                node_parent.add_terminal_edge_ids(string_ids)
+
+    def save(self, path):
+        """writes the tree to path in the columnar format of CompactSuffixTree.save"""
+        from CompactSuffixTree import CompactSuffixTree
+        CompactSuffixTree.from_tree(self).save(path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """loads a tree written by save as CompactSuffixTree, see CompactSuffixTree.load"""
+        from CompactSuffixTree import CompactSuffixTree
+        return CompactSuffixTree.load(path, mmap)
+
+    def _count_strings(self, string_ids):
+        """number of strings (including collapsed duplicates) the given distinct inserted string ids stand for"""
+        if not self.duplicate_ids:
+            return len(string_ids)
+        multiplicities = self.multiplicities
+        return sum(multiplicities[string_id] for string_id in string_ids)
+
+    def _copy_to_duplicates(self, values):
+        """sets the values (list or dict by string_id) of collapsed duplicates to the ones of their first occurrence"""
+        for string_id, duplicate_ids in self.duplicate_ids.items():
+            for duplicate_id in duplicate_ids:
+                values[duplicate_id] = values[string_id]
+
+    def _prefix(self, string_id):
+        """bytes of string_id without termination symbol"""
+        return bytes(self.text[self.strings.start(string_id):self.strings.end(string_id) - 1])
+
+    def _check_prefix_length(self, prefix_length):
+        """raises a ValueError if the paths of prefixes this long are cut off by max_depth"""
+        if self.max_depth is not None and prefix_length > self.max_depth:
+            raise ValueError(f"prefix of length {prefix_length} is longer than the max_depth {self.max_depth} of the "
+                             f"tree")
+
+    def _first_suffix(self, string_start, string_end):
+        """text position of the longest suffix of the string to insert considering max_depth"""
+        if self.max_depth is None:
+            return string_start
+        return max(string_start, string_end - 1 - self.max_depth)
+
+    def _path_label(self, node):
+        """string spelled by the path from the root to node"""
+        return self.text[node.end - node.path_label_length:node.end].decode("ascii")
+
+    def _add_string_naive(self, string_id, verbose=False):
+        string_start, string_end = self.strings.start(string_id), self.strings.end(string_id)
+        # the view is released before the next string gets appended to the text
+        with memoryview(self.text) as text_view:
+            for i in range(self._first_suffix(string_start, string_end), string_end):  # add suffix i..m
+                self._add_suffix_naive(text_view, string_id, string_start, string_end, i)
+                if verbose:
+                    print(self, "\n")
+
+    def _add_suffix_naive(self, text_view, string_id, string_start, string_end, i):
+        """inserts the suffix of string_id starting at text position i, text_view is a memoryview of the text"""
+        text = self.text
+        current_node = self.root
+        suffix_pos = i  # text position of the first suffix character not matched yet
+        node_found = False
+        # find node to add leaf node on, stop if the whole suffix is already in the tree
+        while not node_found and suffix_pos < string_end:
+            # find child node with matching first label character
+            symbol = text[suffix_pos]
+            child = current_node.get_child(symbol)
+            if child is not None:
+                # check rest of the label at once, the first symbol is matched already
+                # compared as memoryviews, which works for memory mapped texts as well
+                if (child.end - child.start == 1
+                        or text_view[suffix_pos + 1:suffix_pos + child.end - child.start]
+                        == text_view[child.start + 1:child.end]):
+                    # matched until next node, repeat process
+                    suffix_pos += child.end - child.start
+                    current_node = child
                 else:
+                    # find splitting point, the suffix ends with the termination symbol so it lies on the label
+                    label_pos = child.start + 1
+                    suffix_pos += 1
+                    while text[suffix_pos] == text[label_pos]:
+                        suffix_pos += 1
+                        label_pos += 1
+                    # add splitting node
+                    split_node = current_node.add_child(symbol, self._create_node(child.start, label_pos))
+                    split_node.add_child(text[label_pos], child)
+                    child.set_start(label_pos)
+                    if self.track_terminal_edges and text[label_pos] == TERMINATION_CODE:
+                        split_node.add_terminal_edge_ids(child.string_id)
+                    # to add leaf node
+                    current_node = split_node
                     node_found = True
-            # add string_id to existing leaf node...
-            if suffix_pos == len(suffix):
-                current_node.add_string_to_leaf(string_id, i)
-                if self.track_terminal_edges and current_node.end - current_node.start == 1:
-                    current_node.parent.add_terminal_edge_ids([string_id])
-            else:  # ...or add new leaf node
-                new_leaf = current_node.add_children(Node(i + suffix_pos, len(string), string_id, i))
-                self.leaves.append(new_leaf)
-                if self.track_terminal_edges and suffix_pos == len(suffix) - 1:
-                    current_node.add_terminal_edge_ids([string_id])
+            # no child matched rest of suffix
+            else:
+                node_found = True
+        # add string_id to existing leaf node...
+        if suffix_pos == string_end:
+            current_node.add_string_to_leaf(string_id, i - string_start)
+            if self.track_terminal_edges and current_node.end - current_node.start == 1:
+                current_node.parent.add_terminal_edge_ids([string_id])
+        else:  # ...or add new leaf node
+            new_leaf = current_node.add_child(text[suffix_pos], self._create_node(
+                suffix_pos, string_end, string_id, i - string_start))
+            self.leaves.append(new_leaf)
+            if self.track_terminal_edges and suffix_pos == string_end - 1:
+                current_node.add_terminal_edge_ids([string_id])
+
+    def _add_string_ukkonen(self, string_id, verbose=False):
+        """
+        Generalized Ukkonen construction. Suffixes that are already in the tree as a leaf of another string (i.e. the
+        extension would be done with the termination symbol on an existing path) get string_id added to that leaf,
+        so the resulting tree is the same as the one built by _add_string_naive.
+        Leaves are created with their final end (end of the string) right away instead of a global end, which is
+        equivalent since the active point never moves past the current phase on a leaf edge of the current string.
+        """
+        text = self.text
+        string_start, string_end = self.strings.start(string_id), self.strings.end(string_id)
+        # active point: node, text position of the first character of the active edge, length on that edge
+        first_suffix = self._first_suffix(string_start, string_end)
+        active_node = self.root
+        active_edge = first_suffix
+        active_length = 0
+        remainder = 0  # number of suffixes not yet explicitly inserted
+        for i in range(first_suffix, string_end):
+            char = text[i]
+            remainder += 1
+            need_suffix_link = None  # last internal node created in this phase
+            while remainder > 0:
+                if active_length == 0:
+                    active_edge = i
+                suffix_start = i - remainder + 1 - string_start
+                # find child of active_node with label starting with the character of the active edge
+                child = active_node.get_child(text[active_edge])
+                if child is None:
+                    # no path continues with char, add new leaf to active_node
+                    new_leaf = active_node.add_child(char, self._create_node(i, string_end, string_id, suffix_start))
+                    self.leaves.append(new_leaf)
+                    if self.track_terminal_edges and char == TERMINATION_CODE:
+                        active_node.add_terminal_edge_ids([string_id])
+                    if need_suffix_link is not None:
+                        need_suffix_link.suffix_link = active_node
+                        need_suffix_link = None
+                else:
+                    # walk down if the active point lies behind child
+                    edge_length = child.end - child.start
+                    if active_length >= edge_length:
+                        active_edge += edge_length
+                        active_length -= edge_length
+                        active_node = child
+                        continue
+                    label_pos = child.start + active_length
+                    if text[label_pos] == char:
+                        if need_suffix_link is not None:
+                            need_suffix_link.suffix_link = active_node
+                            need_suffix_link = None
+                        if char != TERMINATION_CODE:
+                            # suffix is implicitly in the tree already, continue with next phase
+                            active_length += 1
+                            break
+                        # suffix ends in leaf of another string, add string_id to it
+                        child.add_string_to_leaf(string_id, suffix_start)
+                        if self.track_terminal_edges and edge_length == 1:
+                            active_node.add_terminal_edge_ids([string_id])
+                    else:
+                        # add splitting node and new leaf on it
+                        split_node = active_node.add_child(text[active_edge], self._create_node(child.start, label_pos))
+                        split_node.add_child(text[label_pos], child)
+                        child.set_start(label_pos)
+                        new_leaf = split_node.add_child(char, self._create_node(i, string_end, string_id, suffix_start))
+                        self.leaves.append(new_leaf)
+                        if self.track_terminal_edges:
+                            if text[label_pos] == TERMINATION_CODE:
+                                split_node.add_terminal_edge_ids(child.string_id)
+                            if char == TERMINATION_CODE:
+                                split_node.add_terminal_edge_ids([string_id])
+                        if need_suffix_link is not None:
+                            need_suffix_link.suffix_link = split_node
+                        need_suffix_link = split_node
+                remainder -= 1
+                # move active point to the next shorter suffix
+                if active_node is self.root:
+                    if active_length > 0:
+                        active_length -= 1
+                        active_edge = i - remainder + 1
+                else:
+                    active_node = active_node.suffix_link if active_node.suffix_link is not None else self.root
             if verbose:
                 print(self, "\n")
 
-    def _add_string_ukkonen(self, string, string_id, verbose=False):
-        raise NotImplementedError("Ukkonen not yet implemented, pass construction_method=\"naive\" to SuffixTree")
-
     def find_suffix_matches_for_prefix(self, prefix_string_id):
         """
         Finds the length of the longest suffix-prefix match between the given prefix string and all other suffixes
-        in the tree.
+        in the tree. With max_depth set, the prefix string must not be longer than max_depth.
         Args:
             prefix_string_id: prefix_string_id: string_id of the string whose prefix will be tried to be matched
         Returns: list of maximally matched length for each string in the tree
         """
+        self._check_prefix_length(self.strings.length(prefix_string_id) - 1)
+        text = self.text
         current_node = self.root
-        prefix_pos = 0
+        prefix_pos = self.strings.start(prefix_string_id)
         strings_match_lengths = {string_id: 0 for string_id in range(len(self.strings))}
-        while len(current_node.children) > 0:
-            for child in current_node.children:
-                child_string = self.strings[child.string_id[0]]
-                # update maximal path length for each string with terminal edges from current_node
-                if child_string[child.start:child.end] == TERMINATION_SYMBOL:
-                    for string_id in child.string_id:
-                        strings_match_lengths[string_id] = max(strings_match_lengths[string_id], current_node.path_label_length)
-                # look for child with prefix matching label to continue traversal
-                if self.strings[prefix_string_id][prefix_pos] == child_string[child.start]:
-                    new_prefix_pos = prefix_pos + child.end - child.start
-                    new_node = child
-            prefix_pos = new_prefix_pos
-            current_node = new_node
+        while current_node.has_children():
+            # update maximal path length for each string with terminal edges from current_node
+            terminal_child = current_node.get_child(TERMINATION_CODE)
+            if terminal_child is not None:
+                for string_id in terminal_child.string_id:
+                    strings_match_lengths[string_id] = max(strings_match_lengths[string_id],
+                                                           current_node.path_label_length)
+            # continue traversal with child matching the prefix, the whole label matches since the prefix is in the tree
+            current_node = current_node.get_child(text[prefix_pos])
+            prefix_pos += current_node.end - current_node.start
+        # strings ending with the whole prefix string share its leaf
+        for string_id in current_node.string_id:
+            strings_match_lengths[string_id] = current_node.path_label_length - 1
+        self._copy_to_duplicates(strings_match_lengths)
         # remove prefix itself
         strings_match_lengths.pop(prefix_string_id, None)
         return strings_match_lengths
 
+    def find_suffix_matches_for_prefixes(self, prefixes):
+        """
+        Finds the longest suffix-prefix matches of many prefix strings (e.g. adapter variants) at once, following the
+        paths of all prefixes in one traversal of the tree. Unlike find_suffix_matches_for_prefix, the prefixes don't
+        need to be in the tree and only strings with a match are reported. With max_depth set, the prefixes must not be
+        longer than max_depth.
+        Args:
+            prefixes: list of prefix strings
+        Returns: numpy arrays (prefix_indices, string_ids, match_lengths), one entry for every prefix and string with
+        a match of at least one symbol, ordered by prefix index and string id
+        """
+        self._check_prefix_length(max((len(prefix) for prefix in prefixes), default=0))
+        text = self.text
+        encoded_prefixes = [prefix.encode("ascii") for prefix in prefixes]
+        prefix_matches = [{} for _ in prefixes]  # {string_id: match length} for every prefix
+        # [(Node, indices of the prefixes starting with the path label of Node), ...]
+        nodes_left = [(self.root, list(range(len(prefixes))))]
+        while len(nodes_left) > 0:
+            node, prefix_indices = nodes_left.pop()
+            depth = node.path_label_length
+            # strings ending with the path label, deeper nodes visited later overwrite shorter matches
+            terminal_child = node.get_child(TERMINATION_CODE) if node is not self.root else None
+            if terminal_child is not None:
+                for prefix_index in prefix_indices:
+                    matches = prefix_matches[prefix_index]
+                    for string_id in terminal_child.string_id:
+                        matches[string_id] = depth
+            # {first symbol of the rest of the prefix: [prefix index, ...]}
+            prefix_groups = {}
+            for prefix_index in prefix_indices:
+                if len(encoded_prefixes[prefix_index]) > depth:
+                    prefix_groups.setdefault(encoded_prefixes[prefix_index][depth], []).append(prefix_index)
+            for symbol, group in prefix_groups.items():
+                child = node.get_child(symbol)
+                if child is None:
+                    continue
+                label = text[child.start:child.end]
+                child_prefix_indices = []
+                for prefix_index in group:
+                    rest = encoded_prefixes[prefix_index][depth:]
+                    if child.string_id is not None:
+                        # strings of a leaf end with the label before the termination symbol
+                        if rest.startswith(label[:-1]):
+                            for string_id in child.string_id:
+                                prefix_matches[prefix_index][string_id] = depth + len(label) - 1
+                    elif rest.startswith(label):
+                        child_prefix_indices.append(prefix_index)
+                if len(child_prefix_indices) > 0:
+                    nodes_left.append((child, child_prefix_indices))
+
+        for matches in prefix_matches:
+            for string_id in [string_id for string_id in matches if string_id in self.duplicate_ids]:
+                for duplicate_id in self.duplicate_ids[string_id]:
+                    matches[duplicate_id] = matches[string_id]
+        match_count = sum(len(matches) for matches in prefix_matches)
+        prefix_indices = np.repeat(np.arange(len(prefixes), dtype=np.int64),
+                                   [len(matches) for matches in prefix_matches])
+        string_ids = np.empty(match_count, dtype=np.int64)
+        match_lengths = np.empty(match_count, dtype=np.int64)
+        position = 0
+        for matches in prefix_matches:
+            sorted_string_ids = sorted(matches)
+            string_ids[position:position + len(matches)] = sorted_string_ids
+            match_lengths[position:position + len(matches)] = [matches[string_id] for string_id in sorted_string_ids]
+            position += len(matches)
+        return prefix_indices, string_ids, match_lengths
+
     def find_suffix_matches_for_prefix_with_mismatches(self, prefix_string_id, max_mismatch_rate):
         """
         Returns the length of the longest suffix-prefix match between the given prefix string and all other suffixes
@@ -191,78 +688,367 @@ class SuffixTree:
             max_mismatch_rate: number in 0..1 specifying the maximally allowed mismatch percentage
         Returns: list of maximally matched length for each string in the tree
         """
-        prefix_string = self.strings[prefix_string_id]
+        strings_match_lengths = {string_id: 0 for string_id in range(len(self.strings))}
+        for string_ids, suffix_length, _ in self._mismatch_matches(self._prefix(prefix_string_id), max_mismatch_rate):
+            for string_id in string_ids:
+                # update maximally matched length for all strings that have suffix ending here
+                strings_match_lengths[string_id] = max(strings_match_lengths[string_id], suffix_length)
+        self._copy_to_duplicates(strings_match_lengths)
+        # remove prefix itself
+        strings_match_lengths.pop(prefix_string_id, None)
+        return strings_match_lengths
+
+    def find_suffix_matches_for_prefix_with_mismatch_rates(self, prefix_string_id, max_mismatch_rates):
+        """
+        find_suffix_matches_for_prefix_with_mismatches for several mismatch rates at once: the tree is only traversed
+        for the highest rate, every match found is then recorded for all the rates it is within.
+        Args:
+            prefix_string_id: string_id of the string whose prefix will be tried to be matched
+            max_mismatch_rates: iterable of numbers in 0..1 specifying the maximally allowed mismatch percentages
+        Returns: {max_mismatch_rate: list of maximally matched length for each string in the tree, ...}
+        """
+        rates_match_lengths = self._match_lengths_with_mismatch_rates(self._prefix(prefix_string_id),
+                                                                      max_mismatch_rates)
+        for strings_match_lengths in rates_match_lengths.values():
+            # remove prefix itself
+            strings_match_lengths.pop(prefix_string_id, None)
+        return rates_match_lengths
+
+    def _match_lengths_with_mismatch_rates(self, prefix, max_mismatch_rates):
+        """find_suffix_matches_for_prefix_with_mismatch_rates for prefix bytes that don't have to be in the tree"""
+        max_mismatch_rates = sorted(set(max_mismatch_rates))
+        if len(max_mismatch_rates) == 0:
+            return {}
+        prefix_length = len(prefix) + 1  # with termination symbol
+        # [(max_mismatch_rate, maximally possible mismatch count, {string_id: match length}), ...], highest rate first
+        rates_match_lengths = [(max_mismatch_rate, floor(prefix_length * max_mismatch_rate),
+                                {string_id: 0 for string_id in range(len(self.strings))})
+                               for max_mismatch_rate in reversed(max_mismatch_rates)]
+        for string_ids, suffix_length, mismatch_count in self._mismatch_matches(prefix, max_mismatch_rates[-1]):
+            for max_mismatch_rate, max_mismatch_count, strings_match_lengths in rates_match_lengths:
+                # a match too bad for a rate is too bad for all lower ones as well
+                if mismatch_count > max_mismatch_count or mismatch_count / suffix_length > max_mismatch_rate:
+                    break
+                for string_id in string_ids:
+                    strings_match_lengths[string_id] = max(strings_match_lengths[string_id], suffix_length)
+        for _, _, strings_match_lengths in rates_match_lengths:
+            self._copy_to_duplicates(strings_match_lengths)
+        return {max_mismatch_rate: strings_match_lengths
+                for max_mismatch_rate, _, strings_match_lengths in reversed(rates_match_lengths)}
+
+    def _mismatch_matches(self, prefix, max_mismatch_rate):
+        """
+        Branch and bound search for the suffixes matching a prefix of the given prefix string with a certain allowed
+        mismatch percentage: whole edge labels are compared at once and a branch is cut as soon as its mismatches
+        exceed the allowed rate even for the longest possible match, which is no longer than the prefix string and
+        the longest string in the tree. Once no further mismatch is allowed, only the exact continuation is followed.
+        Args:
+            prefix: bytes of the prefix string without termination symbol, it doesn't have to be in the tree
+            max_mismatch_rate: number in 0..1 specifying the maximally allowed mismatch percentage
+        Returns: generator of (string_ids of the leaf or terminal edge, suffix length, mismatch count) for every match
+        """
+        text = self.text
+        prefix_length = len(prefix) + 1  # with termination symbol
         # maximally possible mismatch count no matter the length of the match
-        max_mismatch_count = floor(len(prefix_string) * max_mismatch_rate)
-        # [(prefix_pos, mismatch_count, Node), ...]
+        max_mismatch_count = floor(prefix_length * max_mismatch_rate)
+        offsets = self.strings.offsets
+        max_match_length = max(1, min(len(prefix), max((offsets[i + 1] - offsets[i] for i in range(len(self.strings))),
+                                                       default=1) - 1))
+        # [(matched length, mismatch_count, Node), ...]
         candidate_nodes = [(0, 0, self.root)]
-        strings_match_lengths = {string_id: 0 for string_id in range(len(self.strings))}
         while len(candidate_nodes) > 0:
             # continue search at the state we were at while adding this candidate node
-            node_prefix_pos, node_mismatch_count, current_node = candidate_nodes.pop()
-            # try to match prefix string with all children
-            for child in current_node.children:
-                prefix_pos = node_prefix_pos
-                mismatch_count = node_mismatch_count
-                child_string = self.strings[child.string_id[0]]
-                label_pos = child.start
-                # match label of child node with prefix string one by one until max_mismatch_count exceeded or next node reached
-                while mismatch_count <= max_mismatch_count:
-                    # check if next node reached and if so add it to candidates
-                    if label_pos >= child.end:
-                        candidate_nodes.append((prefix_pos, mismatch_count, child))
-                        break
-                    # check if end of suffix
-                    if child_string[label_pos] == TERMINATION_SYMBOL:
-                        suffix_length = child.path_label_length - 1
-                        # check if matched suffix is still within max_mismatch_rate considering it's length
-                        if suffix_length > 0 and mismatch_count / suffix_length <= max_mismatch_rate:
-                            for string_id in child.string_id:
-                                # update maximally matched length for all strings that have suffix ending here
-                                strings_match_lengths[string_id] = max(strings_match_lengths[string_id], suffix_length)
-                        break
-                    # increment mismatch count if no match
-                    if prefix_string[prefix_pos] != child_string[label_pos]:
-                        mismatch_count += 1
-                    prefix_pos += 1
-                    label_pos += 1
+            depth, node_mismatch_count, current_node = candidate_nodes.pop()
+            if (node_mismatch_count + 1 > max_mismatch_count
+                    or (node_mismatch_count + 1) / max_match_length > max_mismatch_rate):
+                # no mismatch allowed anymore, only the exact continuation of the prefix has to be followed
+                yield from self._extend_exact_match(prefix, depth, node_mismatch_count, current_node,
+                                                    max_mismatch_rate)
+                continue
+            for _, child in current_node.iter_children():
+                label_length = child.end - child.start
+                if child.string_id is not None:
+                    # leaf: suffix ends with the label before the termination symbol, it can't be longer than the prefix
+                    suffix_length = depth + label_length - 1
+                    if suffix_length == 0 or suffix_length > prefix_length - 1:
+                        continue
+                    # skip comparing if the mismatches so far are too many already
+                    if node_mismatch_count / suffix_length > max_mismatch_rate:
+                        continue
+                    mismatch_count = node_mismatch_count + _count_mismatches(prefix, depth, text, child.start,
+                                                                             label_length - 1)
+                    if mismatch_count <= max_mismatch_count and mismatch_count / suffix_length <= max_mismatch_rate:
+                        yield child.string_id, suffix_length, mismatch_count
+                    continue
+                # suffixes below an edge the prefix ends within are longer than the prefix
+                if depth + label_length > prefix_length - 1:
+                    continue
+                if label_length == 1:
+                    mismatch_count = node_mismatch_count + (prefix[depth] != text[child.start])
+                else:
+                    mismatch_count = node_mismatch_count + _count_mismatches(prefix, depth, text, child.start,
+                                                                             label_length)
+                # the mismatch rate of any match below is at least the one of the longest possible match
+                if mismatch_count <= max_mismatch_count and mismatch_count / max_match_length <= max_mismatch_rate:
+                    candidate_nodes.append((depth + label_length, mismatch_count, child))
+
+    def _extend_exact_match(self, prefix, depth, mismatch_count, node, max_mismatch_rate):
+        """
+        Follows the path continuing prefix[:depth] (matched at node with mismatch_count) with the rest of the prefix
+        without further mismatches and yields the matches of the strings ending on the way like _mismatch_matches.
+        """
+        text = self.text
+        while True:
+            terminal_child = node.get_child(TERMINATION_CODE)
+            if terminal_child is not None and depth > 0 and mismatch_count / depth <= max_mismatch_rate:
+                yield terminal_child.string_id, depth, mismatch_count
+            if depth == len(prefix):
+                return
+            child = node.get_child(prefix[depth])
+            if child is None:
+                return
+            label_length = child.end - child.start
+            if child.string_id is not None:
+                # leaf: suffix ends with the label before the termination symbol
+                suffix_length = depth + label_length - 1
+                if (suffix_length <= len(prefix) and mismatch_count / suffix_length <= max_mismatch_rate
+                        and text[child.start:child.end - 1] == prefix[depth:suffix_length]):
+                    yield child.string_id, suffix_length, mismatch_count
+                return
+            if depth + label_length > len(prefix) or text[child.start:child.end] != prefix[depth:depth + label_length]:
+                return
+            node = child
+            depth += label_length
+
+    def find_suffix_matches_for_prefix_with_errors(self, prefix_string_id, max_error_rate):
+        """
+        Like find_suffix_matches_for_prefix_with_mismatches, but insertions and deletions count as errors as well: a
+        suffix matches if its edit distance to some prefix of the prefix string is within the allowed rate of the
+        suffix length. The DP column of the suffix against the prefix string is computed with Myers' bit-parallel
+        algorithm symbol by symbol along the edges, so suffixes sharing a path share its columns. A branch is cut as
+        soon as the column minimum, which never decreases along a path, exceeds the errors any match can have.
+        Args:
+            prefix_string_id: string_id of the string whose prefix will be tried to be matched
+            max_error_rate: number in 0..1 specifying the maximally allowed percentage of edit operations
+        Returns: list of maximally matched length for each string in the tree
+        """
+        strings_match_lengths = self._match_lengths_with_errors(self._prefix(prefix_string_id), max_error_rate)
         # remove prefix itself
         strings_match_lengths.pop(prefix_string_id, None)
         return strings_match_lengths
 
-    def find_most_common_suffixes(self):
+    def _match_lengths_with_errors(self, prefix, max_error_rate):
+        """find_suffix_matches_for_prefix_with_errors for prefix bytes that don't have to be in the tree"""
+        text = self.text
+        prefix_length = len(prefix) + 1  # with termination symbol
+        strings_match_lengths = {string_id: 0 for string_id in range(len(self.strings))}
+        # maximally possible error count no matter the length of the match
+        max_error_count = floor(prefix_length * max_error_rate)
+        offsets = self.strings.offsets
+        max_match_length = min(len(prefix) + max_error_count,
+                               max((offsets[i + 1] - offsets[i] for i in range(len(self.strings))), default=1) - 1)
+        max_error_count = min(max_error_count, floor(max_match_length * max_error_rate))
+        # bit j of a symbol's match vector is set if prefix[j] is that symbol
+        match_vectors = {}
+        for j, symbol in enumerate(prefix):
+            match_vectors[symbol] = match_vectors.get(symbol, 0) | 1 << j
+        mask = (1 << len(prefix)) - 1
+        # [(matched length, error count, positive and negative vertical deltas of its DP column, Node), ...]
+        candidate_nodes = [(0, 0, mask, 0, self.root)] if len(prefix) > 0 else []
+        while len(candidate_nodes) > 0:
+            depth, node_error_count, node_plus, node_minus, current_node = candidate_nodes.pop()
+            for _, child in current_node.iter_children():
+                is_leaf = child.string_id is not None
+                # the termination symbol isn't aligned
+                label_end = child.end - 1 if is_leaf else child.end
+                suffix_length = depth + label_end - child.start
+                # a leaf's suffix length is known, so are the errors it may have
+                allowed_error_count = min(max_error_count, floor(suffix_length * max_error_rate)) if is_leaf \
+                    else max_error_count
+                if node_error_count > allowed_error_count:
+                    continue
+                error_count, plus, minus = node_error_count, node_plus, node_minus
+                # the column minimum grows by at most one per symbol, so it's only looked at once it could be too high
+                next_check = depth + allowed_error_count - error_count + 1
+                for column in range(depth + 1, suffix_length + 1):
+                    # Myers' step for the next symbol, the top row is the suffix itself so its horizontal delta is +1
+                    match_vector = match_vectors.get(text[child.start + column - depth - 1], 0)
+                    vertical = match_vector | minus
+                    horizontal = (((match_vector & plus) + plus) ^ plus) | match_vector
+                    horizontal_plus = (minus | ~(horizontal | plus)) & mask
+                    horizontal_minus = plus & horizontal
+                    horizontal_plus = (horizontal_plus << 1 | 1) & mask
+                    horizontal_minus = (horizontal_minus << 1) & mask
+                    plus = (horizontal_minus | ~(vertical | horizontal_plus)) & mask
+                    minus = horizontal_plus & vertical
+                    if column == next_check or column == suffix_length:
+                        error_count = _column_edit_distance(plus, minus, column, len(prefix),
+                                                            allowed_error_count)
+                        if error_count > allowed_error_count:
+                            break
+                        next_check = column + allowed_error_count - error_count + 1
+                if error_count > allowed_error_count:
+                    continue
+                if is_leaf:
+                    if suffix_length > 0:
+                        for string_id in child.string_id:
+                            # update maximally matched length for all strings that have suffix ending here
+                            strings_match_lengths[string_id] = max(strings_match_lengths[string_id], suffix_length)
+                else:
+                    candidate_nodes.append((suffix_length, error_count, plus, minus, child))
+        self._copy_to_duplicates(strings_match_lengths)
+        return strings_match_lengths
+
+    def all_pairs_suffix_prefix(self, min_length=1):
+        """
+        Gusfield's all-pairs suffix-prefix algorithm: a depth first traversal keeps one stack per string with the
+        depths of the nodes on the current path that have a terminal edge of the string, i.e. where a suffix of the
+        string ends. At the leaf of a whole string j, the top of the stack of string i is the longest suffix of i that
+        is a prefix of j. Strings sharing the leaf of j end with the whole string j. Only works for strings not
+        longer than max_depth.
+        Args:
+            min_length: shortest overlap to report, nodes with less depth are not pushed at all
+        Returns: generator of (suffix_string_id, prefix_string_id, overlap_length) for every ordered pair of
+        different strings with an overlap of at least min_length
+        """
+        min_length = max(min_length, 1)
+        stacks = {}  # {string_id: [depth, ...]}, only strings with at least one depth on the current path
+        # [(Node, is_exit), ...], a node is exited after its whole subtree was traversed
+        nodes_left = [(self.root, False)]
+        while len(nodes_left) > 0:
+            node, is_exit = nodes_left.pop()
+            depth = node.path_label_length
+            terminal_child = node.get_child(TERMINATION_CODE) if depth >= min_length else None
+            if is_exit:
+                for string_id in terminal_child.string_id:
+                    stacks[string_id].pop()
+                    if len(stacks[string_id]) == 0:
+                        del stacks[string_id]
+                continue
+            if node.string_id is not None:
+                # leaf: report the overlaps of every whole string ending here
+                if depth - 1 < min_length:
+                    continue
+                for prefix_string_id, string_pos in zip(node.string_id, node.string_pos):
+                    if string_pos != 0:
+                        continue
+                    overlaps = {string_id: depths[-1] for string_id, depths in stacks.items()}
+                    overlaps.update((string_id, depth - 1) for string_id in node.string_id)
+                    overlaps.pop(prefix_string_id)
+                    yield from self._expand_overlaps(overlaps, prefix_string_id)
+                continue
+            if terminal_child is not None:
+                for string_id in terminal_child.string_id:
+                    stacks.setdefault(string_id, []).append(depth)
+                nodes_left.append((node, True))
+            nodes_left.extend((child, False) for _, child in node.iter_children())
+
+    def _expand_overlaps(self, overlaps, prefix_string_id):
+        """
+        overlaps {suffix_string_id: length} with prefix_string_id as (suffix_string_id, prefix_string_id, length) for
+        all copies of collapsed duplicates, including the overlaps of the copies of prefix_string_id with each other
         """
-        Traverses the whole tree to find the suffix with the most terminal edge ids on the path
+        prefix_string_ids = [prefix_string_id] + self.duplicate_ids.get(prefix_string_id, [])
+        overlaps = list(overlaps.items())
+        if len(prefix_string_ids) > 1:
+            overlaps.append((prefix_string_id, self.strings.length(prefix_string_id) - 1))
+        for string_id, length in overlaps:
+            for suffix_string_id in [string_id] + self.duplicate_ids.get(string_id, []):
+                for copy_id in prefix_string_ids:
+                    if suffix_string_id != copy_id:
+                        yield suffix_string_id, copy_id, length
+
+    def find_most_common_suffixes(self, top_k=1000):
+        """
+        Traverses the whole tree to find the suffix with the most distinct strings ending in a (non-empty) prefix of
+        it, i.e. the strings of the terminal edges on the path to the leaf and of the leaf itself. The strings on the
+        current path are counted in a per string counter, so every node is visited once without copying sets.
+        Args:
+            top_k: number of suffixes to return, the full list would have one entry per leaf
         Returns: list of the form [(number_of_terminal_edge_ids_on_path, suffix_length, Node), ...] ordered by
         most terminal edges and then suffix length, the most common suffix
         """
-        # [(number_of_terminal_edge_ids_on_path, suffix_length, Node), ...]
-        recorded_leaves = []
-        # [(terminal_edge_ids_on_path, Node), ...]
-        nodes_left = [(set(), self.root)]
-        while len(nodes_left) > 0:
-            terminal_edge_ids_on_path, node = nodes_left.pop()
-            nodes_to_be_added = []
-            leaves_to_be_added = []
-            for child in node.children:
-                if self.strings[child.string_id[0]][child.start:child.end] == TERMINATION_SYMBOL:
-                    if node is self.root:
-                        continue  # skip leaf on root with termination symbol
-                    terminal_edge_ids_on_path.update(child.string_id)
-                if len(child.children) > 0:
-                    nodes_to_be_added.append(child)
-                else:
-                    leaves_to_be_added.append(child)
-            nodes_left.extend((terminal_edge_ids_on_path.copy(), node) for node in nodes_to_be_added)
-            recorded_leaves.extend((len(terminal_edge_ids_on_path.union(leaf.string_id)), leaf.path_label_length - 1, leaf)
-                                   for leaf in leaves_to_be_added)
-        recorded_leaves.sort(key=itemgetter(0, 1), reverse=True)
+        # same as the first top_k of a stable sort of all leaves in traversal order
+        recorded_leaves = heapq.nlargest(top_k, self._recorded_leaves(), key=itemgetter(0, 1))
+        if len(recorded_leaves) == 0:
+            return recorded_leaves, ""
         best_terminal_edges, best_length, best_node = recorded_leaves[0]
-        most_common_suffix = self.strings[best_node.string_id[0]][-best_node.path_label_length:-1]
+        most_common_suffix = self._path_label(best_node)[:-1]
         return recorded_leaves, most_common_suffix
 
+    def _recorded_leaves(self):
+        """
+        Generator of (number of distinct strings ending in a non-empty prefix of the leaf's suffix, suffix_length, leaf)
+        for every leaf in traversal order, see find_most_common_suffixes.
+        """
+        multiplicities = self.multiplicities
+        # occurrences of every string on the terminal edges of the current path
+        string_counts = [0] * len(self.strings)
+        distinct_count = 0  # strings (with their duplicates) having at least one terminal edge on the current path
+        # [(Node, is_exit), ...], a node is exited after its whole subtree was traversed
+        nodes_left = [(self.root, False)]
+        while len(nodes_left) > 0:
+            node, is_exit = nodes_left.pop()
+            terminal_child = node.get_child(TERMINATION_CODE) if node is not self.root else None
+            if is_exit:
+                # remove the strings of the terminal edge of node from the path
+                for string_id in terminal_child.string_id:
+                    string_counts[string_id] -= 1
+                    if string_counts[string_id] == 0:
+                        distinct_count -= multiplicities[string_id]
+                continue
+            if terminal_child is not None:
+                for string_id in terminal_child.string_id:
+                    string_counts[string_id] += 1
+                    if string_counts[string_id] == 1:
+                        distinct_count += multiplicities[string_id]
+                nodes_left.append((node, True))
+            inner_children = []
+            for symbol, child in node.iter_children():
+                if symbol == TERMINATION_CODE and node is self.root:
+                    continue  # skip leaf on root with termination symbol
+                if child.has_children():
+                    inner_children.append((child, False))
+                else:
+                    count = distinct_count + sum(multiplicities[string_id] for string_id in child.string_id
+                                                 if string_counts[string_id] == 0)
+                    yield count, child.path_label_length - 1, child
+            nodes_left.extend(inner_children)
+
+    def _count_strings_ending_in_prefixes(self, suffixes):
+        """
+        For every suffix the number of distinct strings (with their duplicates) ending in a non-empty prefix of it,
+        the count find_most_common_suffixes ranks its leaves by, for suffixes that don't have to be leaves of the tree.
+        """
+        text = self.text
+        counts = []
+        for suffix in suffixes:
+            suffix = suffix.encode("ascii")
+            string_ids = set()
+            node, depth = self.root, 0
+            while True:
+                terminal_child = node.get_child(TERMINATION_CODE) if node is not self.root else None
+                if terminal_child is not None:
+                    string_ids.update(terminal_child.string_id)
+                if depth == len(suffix):
+                    break
+                child = node.get_child(suffix[depth])
+                if child is None:
+                    break
+                if child.string_id is not None:
+                    # leaf: its strings end in a prefix of the suffix if the label before the termination symbol is one
+                    if suffix.startswith(text[child.start:child.end - 1], depth):
+                        string_ids.update(child.string_id)
+                    break
+                label_length = child.end - child.start
+                if text[child.start:child.end] != suffix[depth:depth + label_length]:
+                    break
+                node, depth = child, depth + label_length
+            counts.append(sum(self.multiplicities[string_id] for string_id in string_ids))
+        return counts
+
     def __repr__(self):
-        """broken because of missing __dict__"""
+        """broken because of missing __dict__, use save to persist the tree"""
         # needed to remove circularity
         def remove_parent(o):
             if isinstance(o, set):
@@ -280,12 +1066,12 @@ class SuffixTree:
             else:
                 label = "()"
         else:
-            label = f"|-{self.strings[node.string_id[0]][node.start:node.end]}"
+            label = f"|-{self.text[node.start:node.end].decode('ascii')}"
             if node.terminal_edge_ids is not None and len(node.terminal_edge_ids) > 0:
                 label += f" ({', '.join(str(n) for n in node.terminal_edge_ids)})"
-        if len(node.children) > 0:
+        if node.has_children():
             all_lines = []
-            for child in node.children:
+            for _, child in node.iter_children():
                 lines = self.render_children(child)
                 all_lines.extend(lines)
             reached_first_elem = False
@@ -310,26 +1096,33 @@ class SuffixTree:
         """Basis idea: After removing the adapter sequence, barcodes are the longest commonly occuring suffixes of
         the sequences. Moreover, this algorithm assumes that the minimum barcode length is magic_number."""
 
-        number_of_sequences = [0 for _ in range(len(self.strings))]  # i-th entry stores number of sequences that share this suffix of string i
+        # i-th entry stores number of sequences that share this suffix of string i
+        number_of_sequences = [0 for _ in range(len(self.strings))]
         suffixes = [0 for _ in range(len(self.strings))]  # i-th entry stores this suffix of string i
         len_suffixes = [0 for _ in range(len(self.strings))]  # i-th entry stores length of this suffix of string i
 
         for node in self.leaves:
             string_id = node.string_id[0]
-            suffix = self.strings[string_id][-node.path_label_length:-1]
+            suffix = self._path_label(node)[:-1]
             # neglect '$' leave and also suffixes that are shorter then the magic number
             if len(suffix) < magic_number:
                 continue
             # check if more strings then for other suffix of that string end in this suffix, if its more
             # or if its the same number but the length is longer this is the most probable barcode at the moment:
-            if len(node.string_id) > number_of_sequences[string_id] or (len(node.string_id) == number_of_sequences[string_id] and len_suffixes[string_id] > len_suffixes[string_id]):
+            sequence_count = self._count_strings(node.string_id)
+            if (sequence_count > number_of_sequences[string_id]
+                    or (sequence_count == number_of_sequences[string_id]
+                        and len_suffixes[string_id] > len_suffixes[string_id])):
                 for id in node.string_id:
-                    number_of_sequences[id] = len(node.string_id)
+                    number_of_sequences[id] = sequence_count
                     suffixes[id] = suffix
                     len_suffixes[id] = len(suffix)
 
             # else, a suffix before was better so do not do anything for this leaf
 
+        for values in (number_of_sequences, suffixes, len_suffixes):
+            self._copy_to_duplicates(values)
+
         # all barcodes have the same length, so the length that appears most often is the length of the barcodes
         length = max(set(len_suffixes), key=len_suffixes.count)
         barcodes = [suffixes[n][-length:] for n in range(len(suffixes))]
@@ -341,24 +1134,166 @@ class SuffixTree:
             i += 1
         length_of_sequences = {x:[] for x in barcodes}
         for string_id in range(len(self.strings)):
-            length_of_sequences[barcodes[string_id]].append(len(self.strings[string_id]))
+            length_of_sequences[barcodes[string_id]].append(self.strings.length(string_id))
 
-        ordered_number_per_sample = [(k, number_sequences_per_sample[k]) for k in sorted(number_sequences_per_sample, key=number_sequences_per_sample.get, reverse=True)]
+        ordered_number_per_sample = [(k, number_sequences_per_sample[k])
+                                     for k in sorted(number_sequences_per_sample, key=number_sequences_per_sample.get,
+                                                     reverse=True)]
 
         return set(barcodes), sequences_per_sample, ordered_number_per_sample, length_of_sequences
 
+    def annotate(self):
+        """
+        Stores on every node the number of suffixes in the leaves below it (leaf_count) and the number of distinct
+        strings they belong to (string_count), both counting collapsed duplicates. Uses Hui's color set size
+        algorithm: every leaf counts its strings and every string is subtracted once again at the lowest common
+        ancestor of each two of its consecutive leaves in depth first order, so a subtree sum counts each string once.
+        The lowest common ancestor is the deepest node on the current path that was entered before the previous leaf.
+        Has to be called again after adding strings.
+        """
+        multiplicities = self.multiplicities
+        last_leaf_orders = {}  # {string_id: depth first order of the last visited leaf with string_id}
+        path, path_orders = [], []  # nodes from the root to the current node and their depth first order
+        order = 0
+        # [(Node, is_exit), ...], a node is exited after its whole subtree was traversed
+        nodes_left = [(self.root, False)]
+        while len(nodes_left) > 0:
+            node, is_exit = nodes_left.pop()
+            if is_exit:
+                path.pop()
+                path_orders.pop()
+                if len(path) > 0:
+                    path[-1].leaf_count += node.leaf_count
+                    path[-1].string_count += node.string_count
+                continue
+            path.append(node)
+            path_orders.append(order)
+            node.leaf_count = 0
+            node.string_count = 0
+            if node.string_id is not None:
+                for string_id in node.string_id:
+                    weight = multiplicities[string_id]
+                    node.leaf_count += weight
+                    node.string_count += weight
+                    if string_id in last_leaf_orders:
+                        lowest_common_ancestor = path[bisect_right(path_orders, last_leaf_orders[string_id]) - 1]
+                        lowest_common_ancestor.string_count -= weight
+                    last_leaf_orders[string_id] = order
+            order += 1
+            nodes_left.append((node, True))
+            nodes_left.extend((child, False) for _, child in node.iter_children())
+        self.annotated = True
+
+    def count_occurrences(self, substring):
+        """
+        Finds the number of occurrences of substring in the strings and the number of strings containing it in
+        O(len(substring)) with the counts of annotate, which is run first if needed. With max_depth set, only
+        substrings of the inserted suffixes are found.
+        Returns: (number of occurrences, number of strings)
+        """
+        if not self.annotated:
+            self.annotate()
+        text = self.text
+        substring = substring.encode("ascii")
+        current_node = self.root
+        matched = 0
+        while matched < len(substring):
+            current_node = current_node.get_child(substring[matched])
+            if current_node is None:
+                return 0, 0
+            label = text[current_node.start:current_node.end]
+            compared = min(len(label), len(substring) - matched)
+            if label[:compared] != substring[matched:matched + compared]:
+                return 0, 0
+            matched += compared
+        return current_node.leaf_count, current_node.string_count
+
     def count_unique_sequences(self):
-        """Counts the amount of unique sequences in the tree."""
+        """Counts the amount of unique sequences in the tree, only sees strings not longer than max_depth."""
         # [(number of sequence occurrences, sequence), ...]
         unique_sequences = []
         for leaf in self.leaves:
-            # if that suffix represents a whole sequence, count all of the sequences ending here
-            if leaf.path_label_length == len(self.strings[leaf.string_id[0]]):
-                unique_sequences.append((len(leaf.string_id), self.strings[leaf.string_id[0]][:-1]))
+            # count the strings whose whole sequence ends here, the other entries are suffixes of longer strings
+            whole_string_ids = [string_id for string_id, string_pos in zip(leaf.string_id, leaf.string_pos)
+                                if string_pos == 0]
+            if len(whole_string_ids) > 0:
+                unique_sequences.append((self._count_strings(whole_string_ids), self._path_label(leaf)[:-1]))
         unique_sequences.sort(key=itemgetter(0), reverse=True)
         return unique_sequences
 
 
+ROOT_INDEX = 0  # index of the root in a BucketTree
+
+
+class BucketTree:
+    __slots__ = ("starts", "ends", "parents", "subtree_ends", "firsts", "payload_offsets", "payload_string_ids",
+                 "payload_string_pos")
+
+    def __init__(self, tree):
+        """
+        Nodes of the tree a worker built for its buckets in preorder, as columns that are cheap to send back to the
+        process doing the parallel construction.
+        Args:
+            tree: SuffixTree to flatten, children are visited in the order they were added
+        """
+        self.starts = array("q")
+        self.ends = array("q")
+        self.parents = array("q")
+        self.payload_offsets = array("q", [0])  # payload of node i is at payload_offsets[i]:payload_offsets[i + 1]
+        self.payload_string_ids = array("i")
+        self.payload_string_pos = array("i")
+        # [(Node, parent index), ...]
+        nodes_left = [(tree.root, -1)]
+        while len(nodes_left) > 0:
+            node, parent_index = nodes_left.pop()
+            index = len(self.starts)
+            self.starts.append(node.start if node.start is not None else 0)
+            self.ends.append(node.end if node.end is not None else 0)
+            self.parents.append(parent_index)
+            if node.string_id is not None:
+                self.payload_string_ids.extend(node.string_id)
+                self.payload_string_pos.extend(node.string_pos)
+            self.payload_offsets.append(len(self.payload_string_ids))
+            nodes_left.extend((child, index) for child in reversed(list(node.children.values())))
+        # subtree sizes and first suffix (in text order) of every subtree, children come after their parents
+        sizes = [1] * len(self.starts)
+        self.firsts = array("q", [len(tree.text)] * len(self.starts))
+        for index in range(len(self.starts) - 1, 0, -1):
+            payload_start = self.payload_offsets[index]
+            if payload_start < self.payload_offsets[index + 1]:
+                self.firsts[index] = (tree.strings.start(self.payload_string_ids[payload_start])
+                                      + self.payload_string_pos[payload_start])
+            parent_index = self.parents[index]
+            sizes[parent_index] += sizes[index]
+            self.firsts[parent_index] = min(self.firsts[parent_index], self.firsts[index])
+        self.subtree_ends = array("q", (index + size for index, size in enumerate(sizes)))
+
+    def children(self, node_index):
+        """indices of the children of node_index"""
+        child = node_index + 1
+        while child < self.subtree_ends[node_index]:
+            yield child
+            child = self.subtree_ends[child]
+
+
+def _build_bucket_tree(text, offsets, string_ids, max_depth, bucket_length, buckets):
+    """
+    Worker of SuffixTree._construct_parallel, inserts the suffixes of string_ids whose first bucket_length symbols
+    (up to the termination symbol) are one of buckets.
+    Returns: BucketTree of the suffixes
+    """
+    tree = SuffixTree(max_depth=max_depth)
+    tree.strings = EncodedStrings(bytearray(text), offsets)
+    tree.text = tree.strings.text
+    with memoryview(tree.text) as text_view:
+        for string_id in string_ids:
+            string_start, string_end = offsets[string_id], offsets[string_id + 1]
+            for i in range(tree._first_suffix(string_start, string_end), string_end):
+                if text[i:min(i + bucket_length, string_end)] in buckets:
+                    tree._add_suffix_naive(text_view, string_id, string_start, string_end, i)
+    return BucketTree(tree)
+
+
 if __name__ == '__main__':
     # test_string = ["axbcd", "dxbcd", "xbcda", "bxbcd"]
     # test_string = ["cba", "dcb", "edc"]
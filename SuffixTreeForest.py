@@ -0,0 +1,229 @@
+import heapq
+import os
+from multiprocessing import Pipe, Process
+from operator import itemgetter
+import numpy as np
+from SuffixTree import SuffixTree
+
+
+def _shard_worker(connection, tree_arguments):
+    """
+    Holds the tree of one shard and answers the (method name, args) requests of the forest with ("ok", result) or
+    ("error", exception) until it receives None.
+    """
+    tree = SuffixTree(**tree_arguments)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        method_name, args = request
+        try:
+            if method_name == "add_strings":
+                result = [tree.add_string(string) for string in args[0]]
+            elif method_name == "most_common_suffixes":
+                recorded_leaves, _ = tree.find_most_common_suffixes(*args)
+                result = [(count, suffix_length, tree._path_label(leaf)[:-1])
+                          for count, suffix_length, leaf in recorded_leaves]
+            elif method_name == "string":
+                result = tree.strings[args[0]]
+            else:
+                result = getattr(tree, method_name)(*args)
+            connection.send(("ok", result))
+        except Exception as exception:
+            connection.send(("error", exception))
+    connection.close()
+
+
+class SuffixTreeForest:
+    __slots__ = ("shard_count", "string_count", "connections", "processes")
+
+    def __init__(self, strings=None, shards=None, **tree_arguments):
+        """
+        Splits the strings across independent SuffixTrees, one per shard, each held by its own worker process. The
+        answers of the queries either belong to one string or add up across strings, so every query is sent to all
+        shards at once and their results are merged. String i is string i // shards of shard i % shards.
+        Args:
+            strings: string or list of strings to be added to the forest
+            shards: number of trees and worker processes, the number of CPUs by default
+            tree_arguments: arguments of the SuffixTree of every shard, e.g. construction_method or collapse_duplicates
+        """
+        self.shard_count = shards if shards is not None else os.cpu_count() or 1
+        self.string_count = 0
+        self.connections = []
+        self.processes = []
+        for _ in range(self.shard_count):
+            connection, worker_connection = Pipe()
+            process = Process(target=_shard_worker, args=(worker_connection, tree_arguments), daemon=True)
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        if strings is not None:
+            if not isinstance(strings, list):
+                strings = [strings]
+            self.add_strings(strings)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.string_count
+
+    def close(self):
+        """stops the worker processes"""
+        for connection in self.connections:
+            connection.send(None)
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.connections, self.processes = [], []
+
+    def add_string(self, string):
+        """adds single string to the forest and returns it's string_id"""
+        return self.add_strings([string])[0]
+
+    def add_strings(self, strings):
+        """adds the strings to the forest, every shard inserts its part in parallel, and returns their string_ids"""
+        string_ids = list(range(self.string_count, self.string_count + len(strings)))
+        # the shard of the next string is string_count % shard_count
+        first_shard = self.string_count % self.shard_count
+        shard_strings = [[] for _ in range(self.shard_count)]
+        for i, string in enumerate(strings):
+            shard_strings[(first_shard + i) % self.shard_count].append(string)
+        self._fan_out([("add_strings", (shard_strings[shard],)) for shard in range(self.shard_count)])
+        self.string_count += len(strings)
+        return string_ids
+
+    def find_suffix_matches_for_prefix(self, prefix_string_id):
+        """
+        Like SuffixTree.find_suffix_matches_for_prefix, the prefix string is only in one shard, so all shards look
+        for suffix-prefix matches of it with SuffixTree.find_suffix_matches_for_prefixes.
+        Returns: {string_id: maximally matched length} for each string in the forest
+        """
+        prefix = self._string(prefix_string_id)[:-1]
+        strings_match_lengths = {string_id: 0 for string_id in range(self.string_count)}
+        for shard, (_, string_ids, match_lengths) in enumerate(self._fan_out_all("find_suffix_matches_for_prefixes",
+                                                                                 [prefix])):
+            strings_match_lengths.update(zip(self._global_ids(shard, string_ids).tolist(), match_lengths.tolist()))
+        # remove prefix itself
+        strings_match_lengths.pop(prefix_string_id, None)
+        return strings_match_lengths
+
+    def find_suffix_matches_for_prefixes(self, prefixes):
+        """
+        Like SuffixTree.find_suffix_matches_for_prefixes.
+        Returns: numpy arrays (prefix_indices, string_ids, match_lengths) ordered by prefix index and string id
+        """
+        shard_results = self._fan_out_all("find_suffix_matches_for_prefixes", prefixes)
+        prefix_indices = np.concatenate([prefix_indices for prefix_indices, _, _ in shard_results])
+        string_ids = np.concatenate([self._global_ids(shard, string_ids)
+                                     for shard, (_, string_ids, _) in enumerate(shard_results)])
+        match_lengths = np.concatenate([match_lengths for _, _, match_lengths in shard_results])
+        order = np.lexsort((string_ids, prefix_indices))
+        return prefix_indices[order], string_ids[order], match_lengths[order]
+
+    def find_suffix_matches_for_prefix_with_mismatches(self, prefix_string_id, max_mismatch_rate):
+        """Like SuffixTree.find_suffix_matches_for_prefix_with_mismatches, returns a dict by string_id"""
+        return self.find_suffix_matches_for_prefix_with_mismatch_rates(prefix_string_id,
+                                                                       [max_mismatch_rate])[max_mismatch_rate]
+
+    def find_suffix_matches_for_prefix_with_mismatch_rates(self, prefix_string_id, max_mismatch_rates):
+        """Like SuffixTree.find_suffix_matches_for_prefix_with_mismatch_rates, returns dicts by string_id"""
+        prefix = self._string(prefix_string_id)[:-1].encode("ascii")
+        rates_match_lengths = {}
+        for shard, shard_rates_match_lengths in enumerate(self._fan_out_all("_match_lengths_with_mismatch_rates",
+                                                                            prefix, max_mismatch_rates)):
+            for max_mismatch_rate, strings_match_lengths in shard_rates_match_lengths.items():
+                rates_match_lengths.setdefault(max_mismatch_rate, {}).update(
+                    self._global_items(shard, strings_match_lengths))
+        for max_mismatch_rate, strings_match_lengths in rates_match_lengths.items():
+            # remove prefix itself, in string_id order like a single tree
+            strings_match_lengths.pop(prefix_string_id, None)
+            rates_match_lengths[max_mismatch_rate] = dict(sorted(strings_match_lengths.items()))
+        return rates_match_lengths
+
+    def find_suffix_matches_for_prefix_with_errors(self, prefix_string_id, max_error_rate):
+        """Like SuffixTree.find_suffix_matches_for_prefix_with_errors, returns a dict by string_id"""
+        prefix = self._string(prefix_string_id)[:-1].encode("ascii")
+        strings_match_lengths = {}
+        for shard, shard_match_lengths in enumerate(self._fan_out_all("_match_lengths_with_errors", prefix,
+                                                                      max_error_rate)):
+            strings_match_lengths.update(self._global_items(shard, shard_match_lengths))
+        # remove prefix itself
+        strings_match_lengths.pop(prefix_string_id, None)
+        return dict(sorted(strings_match_lengths.items()))
+
+    def count_occurrences(self, substring):
+        """Like SuffixTree.count_occurrences, the counts of all shards summed up"""
+        shard_counts = self._fan_out_all("count_occurrences", substring)
+        return sum(counts[0] for counts in shard_counts), sum(counts[1] for counts in shard_counts)
+
+    def count_unique_sequences(self):
+        """Like SuffixTree.count_unique_sequences, the counts of equal sequences in different shards summed up"""
+        sequence_counts = {}
+        for unique_sequences in self._fan_out_all("count_unique_sequences"):
+            for count, sequence in unique_sequences:
+                sequence_counts[sequence] = sequence_counts.get(sequence, 0) + count
+        unique_sequences = [(count, sequence) for sequence, count in sequence_counts.items()]
+        unique_sequences.sort(key=itemgetter(0), reverse=True)
+        return unique_sequences
+
+    def find_most_common_suffixes(self, top_k=1000):
+        """
+        Like SuffixTree.find_most_common_suffixes, but with the suffixes instead of the leaves: the top_k lists of all
+        shards are merged, a suffix being a leaf in one shard can be inside the tree in another, so the number of
+        strings ending in a prefix of every listed suffix is counted in all shards and summed up. Suffixes that aren't
+        in the top_k of any shard are missed, which only matters for suffixes ranked low in every shard.
+        Returns: list of the form [(number of strings ending in a prefix, suffix_length, suffix), ...] ordered by count
+        and then suffix length, the most common suffix
+        """
+        suffixes = sorted({suffix for recorded_suffixes in self._fan_out_all("most_common_suffixes", top_k)
+                           for _, _, suffix in recorded_suffixes})
+        counts = [sum(shard_counts) for shard_counts in
+                  zip(*self._fan_out_all("_count_strings_ending_in_prefixes", suffixes))]
+        recorded_suffixes = heapq.nlargest(top_k, ((count, len(suffix), suffix)
+                                                   for count, suffix in zip(counts, suffixes)), key=itemgetter(0, 1))
+        if len(recorded_suffixes) == 0:
+            return recorded_suffixes, ""
+        return recorded_suffixes, recorded_suffixes[0][2]
+
+    def _string(self, string_id):
+        """string_id of the forest, including termination symbol"""
+        return self._fan_out([("string", (string_id // self.shard_count,))
+                              if shard == string_id % self.shard_count else None
+                              for shard in range(self.shard_count)])[string_id % self.shard_count]
+
+    def _global_ids(self, shard, string_ids):
+        return string_ids * self.shard_count + shard
+
+    def _global_items(self, shard, values):
+        """(string_id of the forest, value) for the {string_id of the shard: value} of shard"""
+        return ((string_id * self.shard_count + shard, value) for string_id, value in values.items())
+
+    def _fan_out_all(self, method_name, *args):
+        return self._fan_out([(method_name, args)] * self.shard_count)
+
+    def _fan_out(self, requests):
+        """
+        Sends the requests (None for no request to a shard) to all shards before waiting for the first result, so the
+        shards work in parallel, and returns their results by shard.
+        """
+        for connection, request in zip(self.connections, requests):
+            if request is not None:
+                connection.send(request)
+        results = []
+        error = None
+        for connection, request in zip(self.connections, requests):
+            if request is None:
+                results.append(None)
+                continue
+            status, result = connection.recv()
+            if status == "error" and error is None:
+                error = result
+            results.append(result)
+        if error is not None:
+            raise error
+        return results
@@ -0,0 +1,41 @@
+from SuffixTree import SuffixTree
+import matplotlib.pylab as plt
+import time
+
+
+def current_milli_time():
+    return round(time.perf_counter() * 1000)
+
+data = 'datasets/s_1-1_1M.txt'
+
+# Running Time Analysis of the construction methods:
+construction_methods = ["naive", "ukkonen"]
+number_of_lines = [1000, 10000, 100000, 1000000]
+
+sequences = []
+with open(data, 'r') as file:
+    for line_num, line in enumerate(file):
+        if line_num >= max(number_of_lines):
+            break
+        sequences.append(line.strip())
+
+time_needed = {construction_method: [] for construction_method in construction_methods}
+for number in number_of_lines:
+    for construction_method in construction_methods:
+        start_time = current_milli_time()
+        suffix_tree = SuffixTree(sequences[:number], construction_method=construction_method, track_terminal_edges=True)
+        end_time = current_milli_time()
+        time_needed[construction_method].append(end_time - start_time)
+        del suffix_tree
+
+        print(f"Time needed to compute Suffix Tree ({construction_method}): {end_time - start_time} ms with {number} lines")
+
+for construction_method in construction_methods:
+    plt.plot(number_of_lines, time_needed[construction_method], 'x-', label=construction_method)
+plt.xscale('log')
+plt.yscale('log')
+plt.xlabel('Number of Sequences')
+plt.ylabel('Runtime in ms')
+plt.legend()
+plt.grid()
+plt.show()
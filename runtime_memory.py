@@ -0,0 +1,40 @@
+from SuffixTree import SuffixTree
+from CompactSuffixTree import CompactSuffixTree
+from SuffixArrayIndex import SuffixArrayIndex
+import time
+import tracemalloc
+
+
+def current_milli_time():
+    return round(time.perf_counter() * 1000)
+
+data = 'datasets/s_3_sequence_1M.txt'
+
+# Memory Analysis of the index representations:
+index_constructors = {
+    "SuffixTree": lambda sequences: SuffixTree(sequences, construction_method="ukkonen"),
+    "CompactSuffixTree": lambda sequences: CompactSuffixTree(sequences, construction_method="ukkonen"),
+    "SuffixArrayIndex": lambda sequences: SuffixArrayIndex(sequences),
+}
+number_of_lines = [1000, 10000, 100000]
+
+sequences = []
+with open(data, 'r') as file:
+    for line_num, line in enumerate(file):
+        if line_num >= max(number_of_lines):
+            break
+        sequences.append(line.strip())
+
+for number in number_of_lines:
+    number_of_suffixes = sum(len(sequence) + 1 for sequence in sequences[:number])
+    for index_name, index_constructor in index_constructors.items():
+        tracemalloc.start()
+        start_time = current_milli_time()
+        index = index_constructor(sequences[:number])
+        end_time = current_milli_time()
+        memory_used, peak_memory_used = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del index
+
+        print(f"{index_name} with {number} lines: {end_time - start_time} ms, {memory_used} bytes "
+              f"(peak {peak_memory_used} bytes), {memory_used / number_of_suffixes:.1f} bytes per suffix")
@@ -0,0 +1,40 @@
+from SuffixTree import SuffixTree
+import matplotlib.pylab as plt
+import time
+
+
+def current_milli_time():
+    return round(time.perf_counter() * 1000)
+
+data = 'datasets/s_1-1_1M.txt'
+
+# Running Time Analysis of the parallel construction:
+number_of_workers = [1, 2, 4, 8]
+number_of_lines = 100000
+
+if __name__ == '__main__':  # worker processes import this file
+    sequences = []
+    with open(data, 'r') as file:
+        for line_num, line in enumerate(file):
+            if line_num >= number_of_lines:
+                break
+            sequences.append(line.strip())
+
+    time_needed = []
+    for workers in number_of_workers:
+        start_time = current_milli_time()
+        suffix_tree = SuffixTree(sequences, construction_method="naive", track_terminal_edges=True, workers=workers)
+        end_time = current_milli_time()
+        time_needed.append(end_time - start_time)
+        del suffix_tree
+
+        print(f"Time needed to compute Suffix Tree with {workers} workers: {end_time - start_time} ms "
+              f"(speedup {time_needed[0] / time_needed[-1]:.2f}) with {number_of_lines} lines")
+
+    plt.plot(number_of_workers, [time_needed[0] / needed for needed in time_needed], 'x-', label="measured")
+    plt.plot(number_of_workers, number_of_workers, '--', label="linear")
+    plt.xlabel('Number of Workers')
+    plt.ylabel('Speedup')
+    plt.legend()
+    plt.grid()
+    plt.show()
@@ -1,5 +1,8 @@
+from AdapterTrimmer import AdapterTrimmer, StreamingAdapterTrimmer
 from SuffixTree import SuffixTree
+from itertools import islice
 import json
+import os
 import time
 import numpy as np
 import matplotlib.pyplot as plt
@@ -20,13 +23,21 @@ dataset_path = f"datasets/{dataset}"
 number_of_lines = 1000000
 sequences_length = 50  # all sequences are equally long
 max_mismatch_rate = 0.1
+mismatch_rate_sweep = []  # e.g. [0.05, 0.1, 0.25], matches for all these rates are found in one additional traversal
+allow_indels = False  # count insertions and deletions as mismatches as well (edit distance instead of Hamming distance)
+max_depth = len(adapter)  # suffix-prefix matches with the adapter can't be longer than the adapter
+# tree (with the adapter as first string) is saved there on the first run and loaded on later ones, None to always build
+tree_path = None  # e.g. f"trees/{dataset}_lines-{number_of_lines}.tree"
+# match the reads against the known adapter without building a tree, doesn't allow indels: None to use the tree,
+# "numpy" for chunks of reads vectorized (all reads sequences_length long), "streaming" for one read at a time
+adapter_trimmer_type = None
 
 check_correctness_and_print_suffixes = False
 save_outputs = False
 save_graphs = False
 
 lines_param = f"_lines-{number_of_lines}"
-mismatch_param = f"_mismatch-rate-{max_mismatch_rate}"
+mismatch_param = f"_{'error' if allow_indels else 'mismatch'}-rate-{max_mismatch_rate}"
 time_param = f"_{get_current_time_for_filename()}"
 
 outputs_path = "outputs/"
@@ -40,18 +51,40 @@ task2_graph_path = f"{graphs_path}task2_remaining_lengths_distribution{lines_par
 
 # ---------------- Compute Suffix Tree ----------------
 
-suffix_tree = SuffixTree(adapter)
 adapter_string_id = 0
 
-start_time = current_milli_time()
-with open(dataset_path, "r") as file:
-    for line_num, line in enumerate(file):
-        if line_num >= number_of_lines:
-            break
-        suffix_tree.add_string(line.strip())
-end_time = current_milli_time()
 
-print(f"Time needed to compute Suffix Tree: {end_time - start_time} ms")
+def read_sequences():
+    with open(dataset_path, "r") as file:
+        for line in islice(file, number_of_lines):
+            yield line.strip()
+
+
+if adapter_trimmer_type == "numpy":
+    adapter_trimmer = AdapterTrimmer(adapter)
+elif adapter_trimmer_type == "streaming":
+    adapter_trimmer = StreamingAdapterTrimmer(adapter)
+elif tree_path is not None and os.path.exists(tree_path):
+    start_time = current_milli_time()
+    suffix_tree = SuffixTree.load(tree_path)
+    end_time = current_milli_time()
+
+    print(f"Time needed to load Suffix Tree: {end_time - start_time} ms")
+else:
+    suffix_tree = SuffixTree(adapter, max_depth=max_depth, collapse_duplicates=True)
+
+    start_time = current_milli_time()
+    with open(dataset_path, "r") as file:
+        for line_num, line in enumerate(file):
+            if line_num >= number_of_lines:
+                break
+            suffix_tree.add_string(line.strip())
+    end_time = current_milli_time()
+
+    print(f"Time needed to compute Suffix Tree: {end_time - start_time} ms")
+
+    if tree_path is not None:
+        suffix_tree.save(tree_path)
 
 # print(repr(suffix_tree))
 # print(suffix_tree)
@@ -60,13 +93,17 @@ print(f"Time needed to compute Suffix Tree: {end_time - start_time} ms")
 # ---------------- Task 1 ----------------
 
 start_time = current_milli_time()
-adapter_match_lengths = suffix_tree.find_suffix_matches_for_prefix(adapter_string_id)
+if adapter_trimmer_type is not None:
+    # string ids as in the tree, after the adapter
+    adapter_match_lengths = dict(enumerate(map(int, adapter_trimmer.match_lengths(read_sequences())), start=1))
+else:
+    adapter_match_lengths = suffix_tree.find_suffix_matches_for_prefix(adapter_string_id)
 end_time = current_milli_time()
 
 print(f"\nTime needed to find adapter matches: {end_time - start_time} ms")
 print(f"Number of matched sequences: {sum(v > 0 for v in adapter_match_lengths.values())}")
 
-if check_correctness_and_print_suffixes:
+if check_correctness_and_print_suffixes and adapter_trimmer_type is None:
     matched_suffixes = []
     for string_id, match_length in adapter_match_lengths.items():
         matched_suffixes.append(adapter[:match_length])
@@ -94,18 +131,26 @@ else:
 # ---------------- Task 2 ----------------
 
 start_time = current_milli_time()
-adapter_match_lengths_with_mismatches = suffix_tree.find_suffix_matches_for_prefix_with_mismatches(adapter_string_id, max_mismatch_rate)
+if adapter_trimmer_type is not None:
+    adapter_match_lengths_with_mismatches = dict(enumerate(
+        map(int, adapter_trimmer.match_lengths(read_sequences(), max_mismatch_rate)), start=1))
+elif allow_indels:
+    adapter_match_lengths_with_mismatches = suffix_tree.find_suffix_matches_for_prefix_with_errors(adapter_string_id, max_mismatch_rate)
+else:
+    adapter_match_lengths_with_mismatches = suffix_tree.find_suffix_matches_for_prefix_with_mismatches(adapter_string_id, max_mismatch_rate)
 end_time = current_milli_time()
 
 print(f"\nTime needed to find adapter matches with mismatches: {end_time - start_time} ms")
 print(f"Number of matched sequences: {sum(v > 0 for v in adapter_match_lengths_with_mismatches.values())}")
 
-if check_correctness_and_print_suffixes:
+if check_correctness_and_print_suffixes and adapter_trimmer_type is None:
     matched_suffixes = []
     for string_id, match_length in adapter_match_lengths_with_mismatches.items():
         matched_suffix = suffix_tree.strings[string_id][-match_length - 1:-1]
         matched_suffixes.append(matched_suffix)
-        # correctness testing
+        # correctness testing, only the positionwise comparison without indels
+        if allow_indels:
+            continue
         actual_mismatches = sum(adapter[i] != matched_suffix[i] for i in range(match_length))
         if match_length > 0 and actual_mismatches / match_length > max_mismatch_rate:
             print(f"Something went wrong at string {string_id} with match length {match_length}. Mismatches {actual_mismatches}/Mismatch Rate {actual_mismatches / match_length}")
@@ -127,3 +172,15 @@ if save_graphs:
     curr_fig.savefig(task2_graph_path)
 else:
     plt.show()
+
+# ---------------- Mismatch Rate Sweep ----------------
+
+if len(mismatch_rate_sweep) > 0 and adapter_trimmer_type is None:
+    start_time = current_milli_time()
+    rates_match_lengths = suffix_tree.find_suffix_matches_for_prefix_with_mismatch_rates(adapter_string_id, mismatch_rate_sweep)
+    end_time = current_milli_time()
+
+    print(f"\nTime needed to find adapter matches for {len(rates_match_lengths)} mismatch rates: {end_time - start_time} ms")
+    for rate, match_lengths in rates_match_lengths.items():
+        print(f"Mismatch rate {rate}: {sum(v > 0 for v in match_lengths.values())} matched sequences, "
+              f"{sum(match_lengths.values())} bases trimmed")
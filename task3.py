@@ -1,4 +1,5 @@
 from SuffixTree import SuffixTree
+from SuffixArrayIndex import SuffixArrayIndex
 import json
 import time
 import matplotlib.pylab as plt
@@ -19,6 +20,7 @@ dataset_path = f"datasets/{dataset}"
 
 number_of_lines = 1000
 sequences_length = 76  # all sequences are equally long
+index_type = "suffix_tree"  # "suffix_tree" or "suffix_array"
 
 save_outputs = True
 save_graphs = True
@@ -37,9 +39,12 @@ remaining_lengths_distribution_graph_path = f"{graphs_path}task3_remaining_lengt
 unique_sequences_frequency_distribution_graph_path = f"{graphs_path}task3_unique_sequences_frequency_distribution{lines_param}{time_param}.svg"
 
 
+index_constructors = {"suffix_tree": lambda: SuffixTree(collapse_duplicates=True), "suffix_array": SuffixArrayIndex}
+
+
 # ---------------- Compute Suffix Tree ----------------
 
-suffix_tree = SuffixTree()
+suffix_tree = index_constructors[index_type]()
 
 start_time = current_milli_time()
 with open(dataset_path, "r") as file:
@@ -127,7 +132,7 @@ if save_graphs:
 # ---------------- Find most common suffixes of unique sequences ----------------
 del suffix_tree  # doesn't seem to work as intended (i.e. freeing up the memory)
 
-suffix_tree = SuffixTree()
+suffix_tree = index_constructors[index_type]()
 
 start_time = current_milli_time()
 for _, unique_sequence in unique_sequences:
@@ -1,5 +1,9 @@
+from AdapterDiscovery import SuffixSketch, discover_adapter
+from AdapterTrimmer import StreamingAdapterTrimmer
+from ExternalSuffixTree import ExternalSuffixTree
 from SuffixTree import SuffixTree
 import csv
+from itertools import islice
 import matplotlib.pylab as plt
 import time
 import numpy as np
@@ -10,38 +14,98 @@ def current_milli_time():
 check_correctness_and_print_suffixes = False
 number_of_lines = 1e5 # 10687775
 data = 'datasets/MultiplexedSamples'
-
-# Construction of tree
-start_time = current_milli_time()
-suffix_tree = SuffixTree(construction_method="naive", track_terminal_edges=True)
-with open(data,'r') as file:
-    for line_num, line in enumerate(file):
-        if number_of_lines and line_num >= number_of_lines:
-            break
-        suffix_tree.add_string(line.strip())
-end_time = current_milli_time()
-print(f"Time needed for construction of tree: {end_time - start_time} ms")
-
-# finding the adaptersequence:
-start_time = current_milli_time()
-suffix_list, adapter = suffix_tree.find_most_common_suffixes()
-end_time = current_milli_time()
-print(f"Time needed for finding the adaptersequence: {end_time - start_time} ms")
-print('Adapter found: ', adapter)
-
-# remove the adapter from the sequences:
-adapter_string_id = suffix_tree.add_string(adapter[:-1])
-adapter_match_lengths = suffix_tree.find_suffix_matches_for_prefix(adapter_string_id)
-
-sequences_without_adapter = []
-for string_id, match_length in adapter_match_lengths.items():
-    if len(suffix_tree.strings[string_id][:-match_length]) > 0:
-        sequences_without_adapter.append(suffix_tree.strings[string_id][:-match_length])
-
-del suffix_tree
+# "tree": most common suffix of a tree of all reads, "sampling": of trees of growing samples of the reads,
+# "sketch": estimated in one pass over all reads, the last two trim all reads one at a time without a tree of all of them
+# "external": tree of all reads built on disk in buckets of at most external_memory_limit bytes
+adapter_discovery = "tree"
+external_directory = 'datasets/external_tree'
+external_memory_limit = 1 << 30
+
+
+def read_sequences():
+    with open(data, 'r') as file:
+        for line in islice(file, int(number_of_lines) if number_of_lines else None):
+            yield line.strip()
+
+
+def trim_sequences(sequences_and_match_lengths):
+    """sequences without their adapter match, the same for every adapter_discovery, empty ones are left out"""
+    sequences_without_adapter = []
+    for sequence, match_length in sequences_and_match_lengths:
+        sequence = sequence[:len(sequence) - match_length]
+        if len(sequence) > 0:
+            sequences_without_adapter.append(sequence)
+    return sequences_without_adapter
+
+
+if adapter_discovery in ("sampling", "sketch"):
+    start_time = current_milli_time()
+    if adapter_discovery == "sampling":
+        adapter, sampled_reads, is_stable = discover_adapter(data, number_of_lines=int(number_of_lines) if number_of_lines else None)
+        print(f"{sampled_reads} reads sampled, adapter {'stable' if is_stable else 'not stable'}")
+    else:
+        suffix_sketch = SuffixSketch()
+        suffix_sketch.add_reads(read_sequences())
+        suffix_list, adapter = suffix_sketch.most_common_suffixes()
+    end_time = current_milli_time()
+    print(f"Time needed for finding the adaptersequence: {end_time - start_time} ms")
+    if adapter_discovery == "sketch":
+        print('Adapter found (estimated from the sketch counts, may be approximate): ', adapter)
+    else:
+        print('Adapter found: ', adapter)
+
+    # remove the adapter from the sequences:
+    adapter_trimmer = StreamingAdapterTrimmer(adapter[:-1])
+    sequences_without_adapter = trim_sequences((sequence, adapter_trimmer.match_length(sequence))
+                                               for sequence in read_sequences())
+elif adapter_discovery == "external":
+    # Construction of tree
+    start_time = current_milli_time()
+    suffix_tree = ExternalSuffixTree.build(read_sequences(), external_directory, external_memory_limit)
+    end_time = current_milli_time()
+    print(f"Time needed for construction of tree: {end_time - start_time} ms")
+
+    # finding the adaptersequence:
+    start_time = current_milli_time()
+    suffix_list, adapter = suffix_tree.find_most_common_suffixes()
+    end_time = current_milli_time()
+    print(f"Time needed for finding the adaptersequence: {end_time - start_time} ms")
+    print('Adapter found: ', adapter)
+
+    # remove the adapter from the sequences:
+    adapter_match_lengths = suffix_tree.find_suffix_matches_for_prefix(adapter[:-1])
+    sequences_without_adapter = trim_sequences(zip(read_sequences(), adapter_match_lengths.tolist()))
+    del suffix_tree
+else:
+    # Construction of tree
+    start_time = current_milli_time()
+    suffix_tree = SuffixTree(construction_method="naive", track_terminal_edges=True, collapse_duplicates=True)
+    with open(data,'r') as file:
+        for line_num, line in enumerate(file):
+            if number_of_lines and line_num >= number_of_lines:
+                break
+            suffix_tree.add_string(line.strip())
+    end_time = current_milli_time()
+    print(f"Time needed for construction of tree: {end_time - start_time} ms")
+
+    # finding the adaptersequence:
+    start_time = current_milli_time()
+    suffix_list, adapter = suffix_tree.find_most_common_suffixes()
+    end_time = current_milli_time()
+    print(f"Time needed for finding the adaptersequence: {end_time - start_time} ms")
+    print('Adapter found: ', adapter)
+
+    # remove the adapter from the sequences:
+    adapter_string_id = suffix_tree.add_string(adapter[:-1])
+    adapter_match_lengths = suffix_tree.find_suffix_matches_for_prefix(adapter_string_id)
+    # strings without termination symbol
+    sequences_without_adapter = trim_sequences((suffix_tree.strings[string_id][:-1], match_length)
+                                               for string_id, match_length in adapter_match_lengths.items())
+
+    del suffix_tree
 # find barcodes:
 start_time = current_milli_time()
-suffix_tree = SuffixTree(sequences_without_adapter[0], construction_method="naive", track_terminal_edges=True)
+suffix_tree = SuffixTree(sequences_without_adapter[0], construction_method="naive", track_terminal_edges=True, collapse_duplicates=True)
 for sequence in sequences_without_adapter[1:]:
     suffix_tree.add_string(sequence)
 
@@ -0,0 +1,63 @@
+import random
+import pytest
+from math import floor
+from AdapterTrimmer import AdapterTrimmer, MultiAdapterTrimmer, StreamingAdapterTrimmer
+from SuffixTree import SuffixTree
+
+ADAPTERS = ["AGATCGGAAG", "TGGAATTCTC", "AGATCCC"]
+
+
+def random_reads(seed, read_length=20, count=200):
+    """equally long reads, many ending in a prefix of one of the adapters with up to two substituted symbols"""
+    rng = random.Random(seed)
+    reads = []
+    for _ in range(count):
+        adapter = rng.choice(ADAPTERS)
+        overlap = list(adapter[:rng.randint(0, len(adapter))])
+        for _ in range(rng.randint(0, 2)):
+            if len(overlap) > 0:
+                overlap[rng.randrange(len(overlap))] = rng.choice("ACGT")
+        reads.append("".join(rng.choice("ACGT") for _ in range(read_length - len(overlap))) + "".join(overlap))
+    return reads
+
+
+def brute_force_match_length(read, adapter, max_mismatch_rate):
+    """longest overlap within max_mismatch_rate of its length and of the adapter length with termination symbol"""
+    max_mismatch_count = floor((len(adapter) + 1) * max_mismatch_rate)
+    best_length = 0
+    for length in range(1, min(len(read), len(adapter)) + 1):
+        mismatch_count = sum(a != b for a, b in zip(read[len(read) - length:], adapter))
+        if mismatch_count <= max_mismatch_count and mismatch_count / length <= max_mismatch_rate:
+            best_length = length
+    return best_length
+
+
+@pytest.mark.parametrize("max_mismatch_rate", [0, 0.1, 0.2, 0.3])
+def test_trimmers_match_brute_force(max_mismatch_rate):
+    reads = random_reads(0)
+    for adapter in ADAPTERS:
+        expected = [brute_force_match_length(read, adapter, max_mismatch_rate) for read in reads]
+        assert AdapterTrimmer(adapter, chunk_size=64).match_lengths(reads, max_mismatch_rate).tolist() == expected
+        assert list(StreamingAdapterTrimmer(adapter).match_lengths(reads, max_mismatch_rate)) == expected
+
+
+@pytest.mark.parametrize("max_mismatch_rate", [0, 0.2])
+def test_trimmers_match_the_tree(max_mismatch_rate):
+    reads = random_reads(1)
+    tree = SuffixTree([ADAPTERS[0]] + reads, collapse_duplicates=True)
+    tree_match_lengths = tree.find_suffix_matches_for_prefix_with_mismatches(0, max_mismatch_rate)
+    assert list(StreamingAdapterTrimmer(ADAPTERS[0]).match_lengths(reads, max_mismatch_rate)) == \
+        [tree_match_lengths[string_id] for string_id in range(1, len(reads) + 1)]
+
+
+@pytest.mark.parametrize("max_mismatch_rates", [0, 0.2, [0, 0.2, 0.1]])
+def test_multi_adapter_trimmer_matches_brute_force(max_mismatch_rates):
+    reads = random_reads(2) + ["", "A"]
+    rates = max_mismatch_rates if isinstance(max_mismatch_rates, list) else [max_mismatch_rates] * len(ADAPTERS)
+    expected = []
+    for read in reads:
+        # longest match, the first adapter among equally long ones
+        lengths = [brute_force_match_length(read, adapter, rate) for adapter, rate in zip(ADAPTERS, rates)]
+        best_length = max(lengths)
+        expected.append((lengths.index(best_length) if best_length > 0 else None, best_length))
+    assert list(MultiAdapterTrimmer(ADAPTERS, max_mismatch_rates).matches(reads)) == expected
@@ -0,0 +1,30 @@
+from SuffixArrayIndex import SuffixArrayIndex
+from SuffixTree import SuffixTree
+
+
+def test_empty_index_is_built_by_first_query():
+    # how task3.py constructs its index before adding the reads one by one
+    index = SuffixArrayIndex()
+    tree = SuffixTree(collapse_duplicates=True)
+    for read in ["ACGTAGATCG", "TTAGATC", "GGGAGA", "ACGTAGATCG", "CAGATCGG"]:
+        index.add_string(read)
+        tree.add_string(read)
+    adapter_string_id = index.add_string("AGATCGGAAG")
+    tree.add_string("AGATCGGAAG")
+
+    assert index.find_suffix_matches_for_prefix(adapter_string_id) == \
+        tree.find_suffix_matches_for_prefix(adapter_string_id)
+    assert index.find_suffix_matches_for_prefix_with_mismatches(adapter_string_id, 0.2) == \
+        tree.find_suffix_matches_for_prefix_with_mismatches(adapter_string_id, 0.2)
+    assert sorted(index.count_unique_sequences()) == sorted(tree.count_unique_sequences())
+    assert index.find_most_common_suffixes()[1] == tree.find_most_common_suffixes()[1]
+
+
+def test_unique_sequences_of_reads_that_are_suffixes_of_other_reads():
+    # "C" and "GC" end on the leaves of suffixes of "CAGCGGC", "" is the terminal edge of the root
+    reads = ["CAGCGGC", "C", "GC", "C", ""]
+    expected = [(1, ""), (1, "CAGCGGC"), (1, "GC"), (2, "C")]
+    assert sorted(SuffixArrayIndex(reads).count_unique_sequences()) == expected
+    for collapse_duplicates in (False, True):
+        tree = SuffixTree(reads, construction_method="ukkonen", collapse_duplicates=collapse_duplicates)
+        assert sorted(tree.count_unique_sequences()) == expected
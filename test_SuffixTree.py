@@ -0,0 +1,81 @@
+import random
+import pytest
+from CompactSuffixTree import CompactSuffixTree
+from SuffixTree import SuffixTree
+
+ADAPTER = "AGATCGGAAG"
+
+
+def random_reads(seed, count=60, duplicates=10):
+    """reads of varying length, some ending in a (mutated) adapter prefix, some of them repeated"""
+    rng = random.Random(seed)
+    reads = []
+    for _ in range(count):
+        read = "".join(rng.choice("ACGT") for _ in range(rng.randint(0, 16)))
+        overlap = list(ADAPTER[:rng.randint(0, len(ADAPTER))])
+        if len(overlap) > 0 and rng.random() < 0.3:
+            overlap[rng.randrange(len(overlap))] = rng.choice("ACGT")
+        reads.append(read + "".join(overlap))
+    reads.extend(rng.choice(reads) for _ in range(duplicates))
+    rng.shuffle(reads)
+    return [ADAPTER] + reads
+
+
+def query_results(tree):
+    """results of the queries on the adapter (string 0) and the whole tree, without Node objects"""
+    recorded_suffixes, most_common_suffix = tree.find_most_common_suffixes()
+    return {
+        "exact": tree.find_suffix_matches_for_prefix(0),
+        "mismatches": tree.find_suffix_matches_for_prefix_with_mismatches(0, 0.2),
+        "mismatch rates": tree.find_suffix_matches_for_prefix_with_mismatch_rates(0, [0.1, 0.25]),
+        "errors": tree.find_suffix_matches_for_prefix_with_errors(0, 0.2),
+        "overlaps": sorted(tree.all_pairs_suffix_prefix()),
+        "unique sequences": sorted(tree.count_unique_sequences()),
+        "most common suffixes": [(count, suffix_length) for count, suffix_length, _ in recorded_suffixes],
+        "most common suffix": most_common_suffix,
+        "occurrences": [tree.count_occurrences(substring) for substring in ("A", "GATC", "CGGAAG", "TTTT")],
+    }
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_naive_and_ukkonen_trees_give_the_same_results(seed):
+    reads = random_reads(seed)
+    assert query_results(SuffixTree(reads, construction_method="naive")) == \
+        query_results(SuffixTree(reads, construction_method="ukkonen"))
+
+
+@pytest.mark.parametrize("construction_method", ["naive", "ukkonen"])
+def test_collapsed_duplicates_give_the_same_results(construction_method):
+    reads = random_reads(3)
+    tree = SuffixTree(reads, construction_method=construction_method, collapse_duplicates=True)
+    assert query_results(tree) == query_results(SuffixTree(reads, construction_method=construction_method))
+
+    first_ids = {}
+    for string_id, read in enumerate(reads):
+        first_ids.setdefault(read, string_id)
+    assert list(tree.multiplicities) == [reads.count(read) if first_ids[read] == string_id else 0
+                                         for string_id, read in enumerate(reads)]
+    assert tree.duplicate_ids == {first_id: [string_id for string_id, read in enumerate(reads)
+                                             if read == first_read and string_id != first_id]
+                                  for first_read, first_id in first_ids.items() if reads.count(first_read) > 1}
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+@pytest.mark.parametrize("collapse_duplicates", [False, True])
+def test_saved_tree_is_loaded_with_the_same_results(tmp_path, mmap, collapse_duplicates):
+    tree = SuffixTree(random_reads(4), collapse_duplicates=collapse_duplicates)
+    expected = query_results(tree)
+    tree.save(str(tmp_path / "reads.tree"))
+    loaded_tree = SuffixTree.load(str(tmp_path / "reads.tree"), mmap=mmap)
+    assert isinstance(loaded_tree, CompactSuffixTree)
+    assert query_results(loaded_tree) == expected
+    # strings added after loading are collapsed with the loaded ones like before saving
+    if collapse_duplicates and not mmap:
+        loaded_tree.add_string(ADAPTER)
+        assert loaded_tree.multiplicities[0] == tree.multiplicities[0] + 1
+
+
+def test_prefix_longer_than_max_depth_is_rejected():
+    tree = SuffixTree([ADAPTER, "CCAGATC"], max_depth=5)
+    with pytest.raises(ValueError):
+        tree.find_suffix_matches_for_prefix(0)